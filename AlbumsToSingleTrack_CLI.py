@@ -0,0 +1,196 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from album_engine import (
+    GAP_DURATION_MS, BITRATES, PIPELINE_MODES, DEFAULT_WORKERS, DECODE_THREADS, OUTPUT_FORMATS, DEFAULT_FORMAT,
+    LOUDNESS_MODES, MEMORY_BUDGET_MB,
+    AlbumManifest, BatchRunner, JobJournal, LibraryScanner, find_duplicates, make_job,
+)
+
+# Headless entry point for cron/batch use. Only the conversion engine is loaded: no
+# tkinter, no PIL, and no Wikipedia/MusicBrainz lookups.
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Combine each album folder into a single audio file.")
+    parser.add_argument("input_dir", nargs="?", help="Music folder (Artist/Album/... or a single artist folder)")
+    parser.add_argument("output_dir", nargs="?", help="Folder the combined albums are written to")
+    parser.add_argument("--resume", action="store_true",
+                        help="Finish the albums left over from an interrupted run, with that run's settings")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default=DEFAULT_FORMAT,
+                        help="Output format: " + ", ".join(f"{name} = {fmt.label}" for name, fmt in OUTPUT_FORMATS.items()))
+    parser.add_argument("--bitrate", default=BITRATES[-1],
+                        help=f"Bitrate for mp3, opus and aac, e.g. {', '.join(BITRATES)}")
+    parser.add_argument("--gap", choices=["on", "off"], default="on",
+                        help="Insert silence between tracks (off gives gapless joins)")
+    parser.add_argument("--gap-ms", type=int, default=GAP_DURATION_MS, help="Length of the gap in milliseconds")
+    parser.add_argument("--crossfade-ms", type=int, default=0,
+                        help="With --gap off, crossfade this many milliseconds at every track boundary (needs numpy)")
+    parser.add_argument("--loudness", choices=LOUDNESS_MODES, default=LOUDNESS_MODES[0],
+                        help="Level to -18 LUFS: one gain for the album, per track, or only write ReplayGain tags "
+                             "(needs numpy)")
+    parser.add_argument("--mode", choices=PIPELINE_MODES, default=PIPELINE_MODES[0], help="Assembly pipeline")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Albums converted in parallel (1 overlaps one album's decode with the previous encode)")
+    parser.add_argument("--memory-budget", type=int, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="In memory mode, spool albums with more PCM than this to a temporary file next to "
+                             "the output instead (per worker)")
+    parser.add_argument("--decode-threads", type=int, default=DECODE_THREADS,
+                        help="Tracks of one album decoded in parallel")
+    parser.add_argument("--no-art", action="store_true",
+                        help="Do not embed the album folder's cover image (cover.jpg, folder.jpg, ...) in the output")
+    parser.add_argument("--artist-folders", action="store_true",
+                        help="Write Artist/Album.mp3 instead of 'Artist - Album.mp3'")
+    parser.add_argument("--force", action="store_true", help="Rebuild every album, even unchanged ones")
+    parser.add_argument("--hash", action="store_true",
+                        help="Compare file contents (SHA-1) as well as sizes/mtimes to detect changes")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Convert only the best copy of albums found more than once (same track count and "
+                             "track lengths; albums under three tracks also need --quick-hash)")
+    parser.add_argument("--quick-hash", action="store_true",
+                        help="With --skip-duplicates, also compare a few seconds of audio before calling albums copies")
+    parser.add_argument("--full-scan", action="store_true",
+                        help="Ignore the saved library snapshot and list every folder again")
+    parser.add_argument("--trace", metavar="DIR",
+                        help="Write a JSON timing trace (per stage and per track) for every album to DIR")
+    parser.add_argument("--profile", action="store_true",
+                        help="With --trace, also write a cProfile dump per album (stages then run one at a time)")
+    parser.add_argument("--json", action="store_true", help="Print progress as one JSON object per line")
+    return parser.parse_args(argv)
+
+
+class ConsoleReporter:
+    def __init__(self, as_json):
+        self.as_json = as_json
+        self.results = []
+
+    def emit(self, event, **fields):
+        if self.as_json:
+            print(json.dumps(dict(event=event, **fields)), flush=True)
+
+    def on_event(self, key, kind, *values):
+        artist, album = key
+        if kind == "started":
+            self.emit("started", artist=artist, album=album)
+            if not self.as_json:
+                print(f"Converting {artist} - {album}", flush=True)
+        elif kind == "status":
+            self.emit("status", artist=artist, album=album, text=values[0])
+        elif kind == "progress":
+            done, total = values
+            self.emit("progress", artist=artist, album=album, fraction=round(done / total, 4) if total else 0)
+
+    def on_result(self, job, result):
+        self.results.append(result)
+        size_mb = result["size_mb"]
+        speed = result.get("encode_speed")
+        self.emit("done", artist=result["artist"], album=result["album"], success=result["success"],
+                  skipped=result.get("skipped", False), duration=result["duration"],
+                  size_mb=round(size_mb, 2) if size_mb else None, output=job["output_path"],
+                  format=job["format"], encode_speed=round(speed, 1) if speed else None)
+        if not self.as_json:
+            if result.get("skipped"):
+                status = "UP TO DATE"
+            else:
+                status = "OK" if result["success"] else "FAILED"
+            size_str = f" {size_mb:.1f} MB" if size_mb else ""
+            if speed:
+                size_str += f" {job['format']} at {speed:.0f}x"
+            print(f"{status} {result['artist']} - {result['album']} {result['duration']}{size_str}", flush=True)
+
+    def summary(self):
+        skipped = sum(1 for r in self.results if r.get("skipped"))
+        rebuilt = sum(1 for r in self.results if r.get("rebuilt"))
+        converted = sum(1 for r in self.results if r["success"]) - skipped
+        failed = len(self.results) - converted - skipped
+        self.emit("summary", converted=converted, rebuilt=rebuilt, skipped=skipped, failed=failed)
+        if not self.as_json:
+            print(f"Converted {converted} album(s) ({rebuilt} rebuilt), {skipped} up to date, {failed} failed",
+                  flush=True)
+        return failed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile and not args.trace:
+        print("--profile needs --trace DIR to write the dumps to", file=sys.stderr)
+        return 2
+    reporter = ConsoleReporter(args.json)
+    journal = JobJournal("cli")
+    if args.resume:
+        jobs = journal.unfinished()
+        if not jobs:
+            print("Nothing to resume", file=sys.stderr)
+            return 0
+        reporter.emit("resumed", albums=len(jobs))
+        if not args.json:
+            print(f"Resuming {len(jobs)} album(s) from the interrupted run", flush=True)
+        return run_batch(args, reporter, journal, jobs, jobs[0]["output_dir"])
+
+    if not args.input_dir or not args.output_dir:
+        print("input_dir and output_dir are required unless --resume is given", file=sys.stderr)
+        return 2
+    if not os.path.isdir(args.input_dir):
+        print(f"Invalid input directory: {args.input_dir}", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    scan = LibraryScanner().scan(args.input_dir, use_snapshot=not args.full_scan)
+    reporter.emit("scanned", albums=len(scan.albums), folders=scan.dir_count, files=scan.file_count,
+                  changed_folders=scan.changed_dirs, seconds=round(scan.seconds, 3))
+    if not args.json:
+        print(f"Found {len(scan.albums)} albums in {scan.dir_count} folders "
+              f"({len(scan.changed_dirs)} changed since the last scan) in {scan.seconds:.1f}s", flush=True)
+
+    albums = scan.albums
+    if args.skip_duplicates:
+        albums = skip_duplicates(albums, args, reporter)
+
+    gap_ms = args.gap_ms if args.gap == "on" else 0
+    jobs = [make_job(artist, album, album_path, args.output_dir, args.bitrate, args.mode, gap_ms,
+                     args.artist_folders, args.decode_threads, args.trace, args.profile, args.format,
+                     args.crossfade_ms, args.loudness, args.memory_budget, artwork=not args.no_art)
+            for artist, album, album_path in albums]
+    journal.begin(jobs)
+    return run_batch(args, reporter, journal, jobs, args.output_dir)
+
+
+def skip_duplicates(albums, args, reporter):
+    groups, seconds = find_duplicates(albums, args.quick_hash)
+    skipped = set()
+    for group in groups:
+        best, copies = group[0], group[1:]
+        skipped.update(fp.key for fp in copies)
+        reporter.emit("duplicates", keep=best.album_path, skip=[fp.album_path for fp in copies])
+        if not reporter.as_json:
+            print(f"Keeping {best.album_path}, skipping {len(copies)} copy(ies): "
+                  + ", ".join(fp.album_path for fp in copies), flush=True)
+    if not reporter.as_json:
+        print(f"Skipping {len(skipped)} duplicate album(s) ({seconds:.1f}s to compare)", flush=True)
+    return [a for a in albums if (a[0], a[1]) not in skipped]
+
+
+def run_batch(args, reporter, journal, jobs, output_dir):
+    queue = iter(jobs)
+    manifest = None if args.force else AlbumManifest(output_dir, args.hash)
+    runner = BatchRunner(args.workers, reporter.on_event, reporter.on_result, manifest, pipelined=not args.profile,
+                         journal=journal)
+    try:
+        runner.run(lambda: next(queue, None))
+    except KeyboardInterrupt:
+        runner.cancel_all()
+        print("Cancelled; run again with --resume to finish the batch", file=sys.stderr)
+        return 130
+    journal.clear()
+    stage_metrics = runner.metrics()
+    if stage_metrics:
+        reporter.emit("pipeline", stages=stage_metrics)
+    reporter.emit("timings", **runner.summary())
+    return 1 if reporter.summary() else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
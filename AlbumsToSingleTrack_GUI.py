@@ -1,36 +1,69 @@
 import os
+import multiprocessing
+import queue
+import sys
 import threading
+import time
+import traceback
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import requests
-from PIL import Image, ImageTk
-from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont, ImageTk
 import random
-from pydub import AudioSegment
-from pydub.utils import mediainfo
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
-
-GAP_DURATION_MS = 1000
-BITRATES = ["128k", "192k", "256k", "320k"]
+from album_engine import (
+    GAP_DURATION_MS, BITRATES, PIPELINE_MODES, MAX_WORKERS, DEFAULT_WORKERS, OUTPUT_FORMATS, DEFAULT_FORMAT,
+    LOUDNESS_MODES,
+    AlbumManifest, BatchRunner, JobJournal, LibraryScanner, find_duplicates, make_job,
+)
+from album_metadata import PREFETCH_AHEAD, MetadataService
+
+# Set ALBUM_COMBINER_TRACE to a folder to get a JSON timing trace per album there;
+# ALBUM_COMBINER_PROFILE=1 adds a cProfile dump next to each trace.
+TRACE_DIR = os.environ.get("ALBUM_COMBINER_TRACE") or None
+PROFILE = TRACE_DIR is not None and os.environ.get("ALBUM_COMBINER_PROFILE") == "1"
+# Applied to albums without a gap when "Crossfade gapless joins" is ticked.
+SEAM_CROSSFADE_MS = 5
+# How long closing the window waits for a cancelled batch to wind down.
+CLOSE_TIMEOUT_SECONDS = 5
+
+class UIEventChannel:
+    # The only way background threads talk to Tk. post() may be called from any thread;
+    # the Tk loop drains the queue once per frame. Messages posted with a coalesce_key
+    # replace older ones with the same key, so a flood of progress updates for one album
+    # costs a single redraw per frame. A handler that raises is logged and skipped; the
+    # channel keeps draining, or every later update would stop without a word.
+    FRAME_MS = 33
+
+    def __init__(self, master, handlers):
+        self.master = master
+        self.handlers = handlers
+        self.queue = queue.Queue()
+        self.master.after(self.FRAME_MS, self.drain)
 
-def is_valid_audio_file(file_path):
-    try:
-        info = mediainfo(file_path)
-        return 'duration' in info
-    except Exception:
-        return False
+    def post(self, kind, *values, coalesce_key=None):
+        self.queue.put((kind, values, coalesce_key))
 
-def safe_audio_segment(file_path):
-    try:
-        if is_valid_audio_file(file_path):
-            return AudioSegment.from_file(file_path)
-    except Exception as e:
-        print(f"Skipping {file_path}: {e}")
-    return None
+    def dispatch(self, kind, values):
+        try:
+            self.handlers[kind](*values)
+        except Exception:
+            print(f"UI update '{kind}' failed:\n{traceback.format_exc()}", file=sys.stderr)
 
-def extract_sentences(text):
-    return [s.strip() + '.' for s in text.replace('\n', ' ').split('.') if len(s.strip()) > 30]
+    def drain(self):
+        try:
+            coalesced = {}
+            while True:
+                try:
+                    kind, values, coalesce_key = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if coalesce_key is not None:
+                    coalesced[coalesce_key] = (kind, values)
+                else:
+                    self.dispatch(kind, values)
+            for kind, values in coalesced.values():
+                self.dispatch(kind, values)
+        finally:
+            self.master.after(self.FRAME_MS, self.drain)
 
 
 class AlbumConverterApp:
@@ -40,18 +73,40 @@ class AlbumConverterApp:
         self.input_dir = ""
         self.output_dir = ""
         self.to_convert = []
+        # The batch thread pops from to_convert while the Tk thread edits it.
+        self.queue_lock = threading.Lock()
         self.converted = []
-        self.cancel_current = False
+        self.skipped_count = 0
+        self.rebuilt_count = 0
         self.cancel_all = False
+        self.cancel_requested = {}
+        self.batch_cancel_requested = None
+        self.closing = False
+        self.close_deadline = None
         self.current_thread = None
+        self.runner = None
+        self.current_key = None
+        self.job_progress = {}
         self.gap_preferences = {}
-        self.checkbox_vars = {}
-        self.selected_albums = set()
+        self.gap_flags = {}
+        self.album_iids = {}
+        self.iid_keys = {}
+        self.album_paths = {}
+        self.duplicates = {}
+        self.quick_hash = tk.IntVar(value=0)
         self.bitrate = tk.StringVar(value=BITRATES[-1])
+        self.format_labels = {fmt.label: name for name, fmt in OUTPUT_FORMATS.items()}
+        self.output_format = tk.StringVar(value=OUTPUT_FORMATS[DEFAULT_FORMAT].label)
         self.save_in_artist_folder = tk.IntVar(value=0)
+        self.pipeline_mode = tk.StringVar(value=PIPELINE_MODES[0])
+        self.worker_count = tk.IntVar(value=DEFAULT_WORKERS)
+        self.skip_unchanged = tk.IntVar(value=1)
+        self.smooth_seams = tk.IntVar(value=0)
+        self.loudness_mode = tk.StringVar(value=LOUDNESS_MODES[0])
         self.album_art_label = None
         self.album_fact_label = None
         self.current_album_img = None
+        self.placeholder_img = None
         self.current_artist_label = None
         self.current_album_label = None
         self.current_fact_sentences = []
@@ -59,8 +114,22 @@ class AlbumConverterApp:
         self.fact_cycle_job = None
         self.fact_cycle_pairs = []
         self.select_all_var = tk.IntVar(value=1)
+        self.metadata = MetadataService()
+        self.lookup_stats = {}
+        self.scanner = LibraryScanner()
+        self.journal = JobJournal("gui")
         self.setup_ui()
+        self.events = UIEventChannel(self.master, {
+            "job": self.handle_job_event,
+            "result": self.handle_job_result,
+            "dequeued": self.queue_remove,
+            "metadata": self.display_album_art_and_fact,
+            "batch_done": self.finish_batch,
+            "scanned": self.show_scanned_albums,
+            "duplicates": self.show_duplicates,
+        })
         self.master.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.master.after(200, self.offer_resume)
 
 
     def setup_ui(self):
@@ -83,10 +152,39 @@ class AlbumConverterApp:
             variable=self.save_in_artist_folder)
         self.save_artist_folder_cb.grid(row=1, column=3, padx=10, sticky="w")
 
-        tk.Label(dir_frame, text="MP3 Bitrate:").grid(row=2, column=0, sticky="e")
+        tk.Label(dir_frame, text="Bitrate:").grid(row=2, column=0, sticky="e")
         self.bitrate_dropdown = ttk.Combobox(dir_frame, textvariable=self.bitrate, values=BITRATES, width=10, state="readonly")
         self.bitrate_dropdown.grid(row=2, column=1, sticky="w")
 
+        tk.Label(dir_frame, text="Format:").grid(row=5, column=0, sticky="e")
+        self.format_dropdown = ttk.Combobox(dir_frame, textvariable=self.output_format,
+                                            values=list(self.format_labels), width=20, state="readonly")
+        self.format_dropdown.grid(row=5, column=1, sticky="w")
+        self.format_dropdown.bind("<<ComboboxSelected>>", self.on_format_selected)
+
+        tk.Label(dir_frame, text="Loudness:").grid(row=6, column=0, sticky="e")
+        self.loudness_dropdown = ttk.Combobox(dir_frame, textvariable=self.loudness_mode, values=LOUDNESS_MODES,
+                                              width=10, state="readonly")
+        self.loudness_dropdown.grid(row=6, column=1, sticky="w")
+
+        tk.Label(dir_frame, text="Pipeline:").grid(row=3, column=0, sticky="e")
+        self.pipeline_dropdown = ttk.Combobox(dir_frame, textvariable=self.pipeline_mode, values=PIPELINE_MODES, width=10, state="readonly")
+        self.pipeline_dropdown.grid(row=3, column=1, sticky="w")
+
+        tk.Label(dir_frame, text="Parallel Albums:").grid(row=4, column=0, sticky="e")
+        self.worker_spinbox = ttk.Spinbox(dir_frame, from_=1, to=MAX_WORKERS, textvariable=self.worker_count, width=5, state="readonly")
+        self.worker_spinbox.grid(row=4, column=1, sticky="w")
+
+        self.skip_unchanged_cb = tk.Checkbutton(
+            dir_frame, text="Skip albums that are already up to date",
+            variable=self.skip_unchanged)
+        self.skip_unchanged_cb.grid(row=2, column=3, padx=10, sticky="w")
+
+        self.smooth_seams_cb = tk.Checkbutton(
+            dir_frame, text=f"Crossfade gapless joins ({SEAM_CROSSFADE_MS} ms)",
+            variable=self.smooth_seams)
+        self.smooth_seams_cb.grid(row=3, column=3, padx=10, sticky="w")
+
         # Right-aligned Cancel buttons
         cancel_frame = tk.Frame(dir_frame)
         cancel_frame.grid(row=0, column=10, rowspan=2, sticky="ne", padx=(410,0))
@@ -103,6 +201,8 @@ class AlbumConverterApp:
         self.left_frame = tk.Frame(main_frame, bg="white", bd=1, relief=tk.SOLID, width=300)
         self.left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=False, padx=5, pady=(40, 5))  # Match pady with right column
         tk.Label(self.left_frame, text="Converted Albums", bg="white", font=("Arial", 12)).pack()
+        self.converted_summary_label = tk.Label(self.left_frame, text="", bg="white", font=("Arial", 9))
+        self.converted_summary_label.pack()
         self.converted_text = tk.Text(self.left_frame, width=40, height=30, wrap=tk.WORD)
         self.converted_text.pack(fill=tk.BOTH, expand=True)
 
@@ -122,29 +222,32 @@ class AlbumConverterApp:
         remove_button = ttk.Button(right_controls_frame, text="Remove Selected", command=self.remove_selected_albums)
         remove_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+        self.duplicates_button = ttk.Button(right_controls_frame, text="Find Duplicates",
+                                            command=self.find_duplicate_albums)
+        self.duplicates_button.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Checkbutton(right_controls_frame, text="Compare audio", variable=self.quick_hash).pack(side=tk.LEFT)
+
         # The Albums to Convert label and box
         self.right_frame = tk.Frame(self.right_outer_frame, bg="white", bd=1, relief=tk.SOLID, width=300)
         self.right_frame.pack(fill=tk.BOTH, expand=True)
         tk.Label(self.right_frame, text="Albums to Convert", bg="white", font=("Arial", 12)).pack(anchor="n", pady=(0, 0))
 
-        header_frame = tk.Frame(self.right_frame, bg="white")
-        header_frame.pack(fill=tk.X, padx=5, pady=5)
-        tk.Label(header_frame, text="gap", bg="white").grid(row=0, column=0, sticky="w", padx=(2, 10))
-        tk.Label(header_frame, text="Artist", bg="white", width=18, anchor="w").grid(row=0, column=1, sticky="w")
-        tk.Label(header_frame, text="Album", bg="white", width=18, anchor="w").grid(row=0, column=2, sticky="w")
-
-        self.album_canvas = tk.Canvas(self.right_frame, bg="white")
-        self.album_scrollbar = tk.Scrollbar(self.right_frame, orient="vertical", command=self.album_canvas.yview)
-        self.album_scroll_frame = tk.Frame(self.album_canvas, bg="white")
-
-        self.album_scroll_frame.bind(
-            "<Configure>",
-            lambda e: self.album_canvas.configure(scrollregion=self.album_canvas.bbox("all"))
-        )
-
-        self.album_canvas.create_window((0, 0), window=self.album_scroll_frame, anchor="nw")
-        self.album_canvas.configure(yscrollcommand=self.album_scrollbar.set, bg="white")
-        self.album_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # A Treeview only draws the rows that are visible, so the queue stays responsive
+        # with thousands of albums. The gap column acts as a checkbox.
+        self.album_tree = ttk.Treeview(self.right_frame, columns=("gap", "artist", "album"),
+                                       show="headings", selectmode="extended")
+        self.album_tree.heading("gap", text="gap")
+        self.album_tree.heading("artist", text="Artist", anchor="w")
+        self.album_tree.heading("album", text="Album", anchor="w")
+        self.album_tree.column("gap", width=40, stretch=False, anchor="center")
+        self.album_tree.column("artist", width=150, anchor="w")
+        self.album_tree.column("album", width=150, anchor="w")
+        self.album_tree.tag_configure("duplicate", foreground="gray")
+        self.album_tree.bind("<Button-1>", self.on_album_tree_click)
+        self.album_tree.bind("<Double-1>", self.promote_duplicate)
+        self.album_scrollbar = ttk.Scrollbar(self.right_frame, orient="vertical", command=self.album_tree.yview)
+        self.album_tree.configure(yscrollcommand=self.album_scrollbar.set)
+        self.album_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.album_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
         # CENTER COLUMN: Current Album/Controls
@@ -176,93 +279,134 @@ class AlbumConverterApp:
         self.album_fact_label.pack(pady=5)
 
     def show_no_art_placeholder(self):
-        from PIL import ImageDraw, ImageFont
-        size = 400
-        img = Image.new("RGB", (size, size), "#444")
-        draw = ImageDraw.Draw(img)
+        # Drawn (font lookup included) the first time only, then reused for every album.
+        if self.placeholder_img is None:
+            size = 400
+            img = Image.new("RGB", (size, size), "#444")
+            draw = ImageDraw.Draw(img)
 
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            font = ImageFont.load_default()
-
-        text = "No Album Art Found"
-        bbox = draw.textbbox((0, 0), text, font=font)
-        w = bbox[2] - bbox[0]
-        h = bbox[3] - bbox[1]
-        draw.text(((size - w) // 2, (size - h) // 2), text, fill="white", font=font)
-
-        tk_img = ImageTk.PhotoImage(img)
-        self.album_art_label.config(image=tk_img)
-        self.current_album_img = tk_img
-
-
-    def update_album_lists(self):
-        self.converted_text.delete(1.0, tk.END)
-        for artist, album, success, duration, size in self.converted:
-            status = "✅" if success else "❌"
-            size_str = f"{size:.1f} MB" if size else ""
-            prefix = f"({duration}) {size_str}" if duration else ""
-            entry = f"{prefix} {status}\n{artist}\n{album}\n\n"
-            self.converted_text.insert(tk.END, entry)
-        for widget in self.album_scroll_frame.winfo_children():
-            widget.destroy()
-        self.row_widgets = {}
-        # Do not reset checkbox_vars here! This preserves their state.
-        for idx, (artist, album) in enumerate(self.to_convert):
-            key = (artist, album)
-            if key not in self.checkbox_vars:
-                self.checkbox_vars[key] = tk.IntVar(value=1)
-            var = self.checkbox_vars[key]
-            row = tk.Frame(self.album_scroll_frame, bg="white")
-            row.pack(fill="x", padx=5, pady=2)
-            cb = tk.Checkbutton(row, variable=var, bg="white")
-            cb.grid(row=0, column=0, sticky="w")
-            artist_label = tk.Label(row, text=artist, bg="white", anchor="w", width=18, wraplength=140, justify="left")
-            artist_label.grid(row=0, column=1, sticky="w")
-            album_label = tk.Label(row, text=album, bg="white", anchor="w", width=18, wraplength=140, justify="left")
-            album_label.grid(row=0, column=2, sticky="w")
-            def on_row_click(event, key=key, row=row):
-                if key in self.selected_albums:
-                    self.selected_albums.remove(key)
-                    row.config(bg="white")
-                    for child in row.winfo_children():
-                        child.config(bg="white")
-                else:
-                    self.selected_albums.add(key)
-                    row.config(bg="#cce6ff")
-                    for child in row.winfo_children():
-                        child.config(bg="#cce6ff")
-            row.bind("<Button-1>", on_row_click)
-            for child in row.winfo_children():
-                child.bind("<Button-1>", on_row_click)
-            self.row_widgets[key] = row
-            if key in self.selected_albums:
-                row.config(bg="#cce6ff")
-                for child in row.winfo_children():
-                    child.config(bg="#cce6ff")
-            else:
-                row.config(bg="white")
-                for child in row.winfo_children():
-                    child.config(bg="white")
+            try:
+                font = ImageFont.truetype("arial.ttf", 24)
+            except:
+                font = ImageFont.load_default()
+
+            text = "No Album Art Found"
+            bbox = draw.textbbox((0, 0), text, font=font)
+            w = bbox[2] - bbox[0]
+            h = bbox[3] - bbox[1]
+            draw.text(((size - w) // 2, (size - h) // 2), text, fill="white", font=font)
+            self.placeholder_img = ImageTk.PhotoImage(img)
+
+        self.album_art_label.config(image=self.placeholder_img)
+        self.current_album_img = self.placeholder_img
+
+
+    def refresh_album_queue(self):
+        # Duplicate copies are listed (greyed out) under the copy that will be converted.
+        self.queue_clear()
+        with self.queue_lock:
+            queued = list(self.to_convert)
+        for key in queued:
+            self.queue_insert(key)
+            for copy in self.duplicates.get(key, ()):
+                self.queue_insert(copy, parent=self.album_iids[key])
+
+    def queue_insert(self, key, parent=""):
+        # Keep existing gap choices; new albums default to a gap.
+        self.gap_flags.setdefault(key, True)
+        artist, album = key
+        if parent:
+            iid = self.album_tree.insert(parent, tk.END, values=("", artist, f"↳ {album}"), tags=("duplicate",))
+            self.album_tree.item(parent, open=True)
+        else:
+            iid = self.album_tree.insert("", tk.END, values=(self.gap_mark(key), artist, album))
+        self.album_iids[key] = iid
+        self.iid_keys[iid] = key
+
+    def queue_remove(self, key):
+        iid = self.album_iids.pop(key, None)
+        if iid is not None:
+            for child in self.album_tree.get_children(iid):
+                self.album_iids.pop(self.iid_keys.pop(child), None)
+            del self.iid_keys[iid]
+            self.album_tree.delete(iid)
+
+    def queue_clear(self):
+        self.album_tree.delete(*self.album_tree.get_children())
+        self.album_iids = {}
+        self.iid_keys = {}
+
+    def gap_mark(self, key):
+        return "☑" if self.gap_flags.get(key, True) else "☐"
+
+    def on_album_tree_click(self, event):
+        if self.album_tree.identify_region(event.x, event.y) != "cell":
+            return None
+        if self.album_tree.identify_column(event.x) != "#1":
+            return None
+        iid = self.album_tree.identify_row(event.y)
+        key = self.iid_keys.get(iid)
+        if key is None or key not in self.to_convert:
+            return None
+        self.gap_flags[key] = not self.gap_flags.get(key, True)
+        self.album_tree.set(iid, "gap", self.gap_mark(key))
+        return "break"  # toggling the gap box should not change the selection
+
+    def on_format_selected(self, event=None):
+        # VBR and lossless presets choose their own rate.
+        fixed = OUTPUT_FORMATS[self.format_labels[self.output_format.get()]].kbps is not None
+        self.bitrate_dropdown.config(state="disabled" if fixed else "readonly")
+
+    def add_converted_entry(self, result):
+        if result.get("skipped"):
+            status = "⏭ up to date"
+        else:
+            status = "✅" if result["success"] else "❌"
+        size = result["size_mb"]
+        size_str = f"{size:.1f} MB" if size else ""
+        if result.get("format"):
+            size_str += f" {result['format'].upper()}"
+        if result.get("encode_speed"):
+            size_str += f" {result['encode_speed']:.0f}x"
+        prefix = f"({result['duration']}) {size_str}" if result["duration"] else ""
+        entry = f"{prefix} {status}\n{result['artist']}\n{result['album']}\n\n"
+        self.converted_text.insert(tk.END, entry)
+        if result.get("skipped"):
+            self.skipped_count += 1
+        if result.get("rebuilt"):
+            self.rebuilt_count += 1
+        if self.skipped_count or self.rebuilt_count:
+            self.converted_summary_label.config(
+                text=f"Rebuilt: {self.rebuilt_count}   Up to date: {self.skipped_count}")
 
     def toggle_all_checkboxes(self):
-        value = self.select_all_var.get()
-        for var in self.checkbox_vars.values():
-            var.set(value)
+        value = bool(self.select_all_var.get())
+        for key, iid in self.album_iids.items():
+            self.gap_flags[key] = value
+            if not self.album_tree.parent(iid):  # duplicate copies have no gap box
+                self.album_tree.set(iid, "gap", self.gap_mark(key))
 
     def remove_selected_albums(self):
-        for key in list(self.selected_albums):
-            if key in self.to_convert:
-                self.to_convert.remove(key)
-            if key in self.checkbox_vars:
-                del self.checkbox_vars[key]
-            self.selected_albums.remove(key)
+        for iid in self.album_tree.selection():
+            key = self.iid_keys.get(iid)
+            if key is None:
+                continue
+            with self.queue_lock:
+                queued = key in self.to_convert
+                if queued:
+                    self.to_convert.remove(key)
+            if queued and self.runner:
+                self.journal.drop(self.build_job(key))
+            self.duplicates.pop(key, None)  # its copies leave the list with it
+            for copies in self.duplicates.values():
+                if key in copies:
+                    copies.remove(key)
+            self.gap_flags.pop(key, None)
+            self.queue_remove(key)
         if not self.to_convert:
             self.album_art_label.config(image='')
             self.album_fact_label.config(text="")
             self.current_album_img = None
-        self.update_album_lists()
 
     def browse_input(self):
         path = filedialog.askdirectory()
@@ -270,7 +414,6 @@ class AlbumConverterApp:
             self.input_entry.delete(0, tk.END)
             self.input_entry.insert(0, path)
             self.load_albums()
-            self.start_button.config(state="normal")
 
     def browse_output(self):
         path = filedialog.askdirectory()
@@ -280,46 +423,125 @@ class AlbumConverterApp:
 
     def load_albums(self):
         root_dir = self.input_entry.get().strip()
-        self.to_convert = []
+        with self.queue_lock:
+            self.to_convert = []
         if not root_dir or not os.path.isdir(root_dir):
             messagebox.showerror("Error", "Invalid input directory")
             return False
 
-        entries = [e for e in os.listdir(root_dir) if not e.startswith('.')]
-        for entry in entries:
-            entry_path = os.path.join(root_dir, entry)
-            if not os.path.isdir(entry_path):
-                continue
+        # Scanning a large or network library can take a while; keep the window responsive.
+        self.start_button.config(state="disabled")
+        self.status_label.config(text="Scanning library...")
+        threading.Thread(target=self.scan_library, args=(root_dir,), daemon=True).start()
+        return True
 
-            subentries = [s for s in os.listdir(entry_path) if not s.startswith('.')]
-            subdirs = [os.path.join(entry_path, s) for s in subentries if os.path.isdir(os.path.join(entry_path, s))]
-
-            if subdirs:
-                # Looks like Artist > Album structure
-                for album_path in subdirs:
-                    album = os.path.basename(album_path)
-                    artist = os.path.basename(entry_path)
-                    self.to_convert.append((artist, album))
-            else:
-                # Looks like we opened an Artist folder directly, and these are albums
-                artist = os.path.basename(root_dir)
-                album = entry
-                self.to_convert.append((artist, album))
-
-        self.selected_albums.clear()
-        self.update_album_lists()
+    def scan_library(self, root_dir):
+        try:
+            result = self.scanner.scan(root_dir)
+        except Exception as e:
+            print(f"Scan failed for {root_dir}: {e}")
+            result = None
+        self.events.post("scanned", root_dir, result)
+
+    def show_scanned_albums(self, root_dir, result):
+        if root_dir != self.input_entry.get().strip():
+            return  # a different folder was picked while this one was scanning
         self.start_button.config(state="normal")
-        return True
+        if result is None:
+            self.status_label.config(text="Could not scan the input directory")
+            return
+        self.album_paths = {}
+        self.duplicates = {}
+        for artist, album, album_path in result.albums:
+            self.album_paths[(artist, album)] = album_path
+        with self.queue_lock:
+            self.to_convert = [(artist, album) for artist, album, _ in result.albums]
+        self.refresh_album_queue()
+        self.status_label.config(
+            text=f"Found {len(result.albums)} albums in {result.dir_count} folders "
+                 f"({len(result.changed_dirs)} changed) in {result.seconds:.1f}s")
+
+    def find_duplicate_albums(self):
+        # Fingerprinting reads every file's headers (and with "Compare audio" decodes a few
+        # seconds of each album), so it runs in the background like the scan.
+        if self.runner:
+            return
+        keys = self.to_convert + [copy for copies in self.duplicates.values() for copy in copies]
+        if len(keys) < 2:
+            return
+        albums = [(artist, album, self.album_paths[(artist, album)]) for artist, album in keys]
+        quick_hash = bool(self.quick_hash.get())
+        self.duplicates_button.config(state="disabled")
+        self.status_label.config(text="Looking for duplicate albums...")
+
+        def work():
+            try:
+                groups, seconds = find_duplicates(albums, quick_hash)
+            except Exception as e:
+                print(f"Duplicate search failed: {e}")
+                groups, seconds = None, 0.0
+            self.events.post("duplicates", keys, groups, seconds)
 
+        threading.Thread(target=work, daemon=True).start()
 
+    def show_duplicates(self, keys, groups, seconds):
+        self.duplicates_button.config(state="normal")
+        if groups is None:
+            self.status_label.config(text="Could not compare the albums")
+            return
+        listed = set(self.to_convert) | {copy for copies in self.duplicates.values() for copy in copies}
+        if self.runner or listed != set(keys):
+            self.status_label.config(text="The album list changed; look for duplicates again")
+            return
+        self.duplicates = {}
+        for group in groups:
+            best, copies = group[0].key, [fp.key for fp in group[1:]]
+            self.duplicates[best] = copies
+        set_aside = {copy for copies in self.duplicates.values() for copy in copies}
+        with self.queue_lock:
+            self.to_convert = [key for key in keys if key not in set_aside]
+        self.refresh_album_queue()
+        self.status_label.config(
+            text=f"{len(set_aside)} duplicate copies of {len(groups)} album(s) set aside in {seconds:.1f}s; "
+                 f"double-click a copy to convert it instead")
+
+    def promote_duplicate(self, event):
+        # Swap a set-aside copy with the copy that was going to be converted.
+        key = self.iid_keys.get(self.album_tree.identify_row(event.y))
+        best = next((best for best, copies in self.duplicates.items() if key in copies), None)
+        if best is None or self.runner or best not in self.to_convert:
+            return None
+        copies = self.duplicates.pop(best)
+        copies.remove(key)
+        self.duplicates[key] = [best] + copies
+        with self.queue_lock:
+            self.to_convert[self.to_convert.index(best)] = key
+        self.refresh_album_queue()
+        return "break"
 
     def cancel_album(self):
-        self.cancel_current = True
+        # job_progress holds the albums still running, oldest first. The one on display is
+        # cancelled if it is still running, else the oldest one not already cancelled.
+        if not self.runner:
+            return
+        running = [key for key in self.job_progress if key not in self.cancel_requested]
+        if not running:
+            return
+        key = self.current_key if self.current_key in running else running[0]
+        self.cancel_requested[key] = time.perf_counter()
+        self.runner.cancel_job(key)
 
     def cancel_batch(self):
         self.cancel_all = True
-        self.cancel_current = True
-        self.to_convert.clear()
+        with self.queue_lock:
+            self.to_convert.clear()
+        self.queue_clear()
+        if self.runner:
+            now = time.perf_counter()
+            self.batch_cancel_requested = now
+            for key in self.job_progress:
+                self.cancel_requested.setdefault(key, now)
+            self.runner.cancel_all()
 
     def start_conversion(self):
         self.output_dir = self.output_entry.get().strip()
@@ -327,33 +549,179 @@ class AlbumConverterApp:
             messagebox.showerror("Error", "Invalid output directory")
             return
         # Respect the actual state of each checkbox
-        for key, var in self.checkbox_vars.items():
-            self.gap_preferences[key] = var.get() == 1
-        self.update_album_lists()
+        for key, gap in self.gap_flags.items():
+            self.gap_preferences[key] = gap
+        # Snapshot the settings here: worker threads must not read Tk variables.
+        self.job_settings = {
+            "bitrate": self.bitrate.get(),
+            "mode": self.pipeline_mode.get(),
+            "format": self.format_labels[self.output_format.get()],
+            "crossfade_ms": SEAM_CROSSFADE_MS if self.smooth_seams.get() else 0,
+            "loudness": self.loudness_mode.get(),
+            "in_artist_folder": bool(self.save_in_artist_folder.get()),
+        }
+        self.cancel_all = False
+        self.job_progress = {}
         self.start_button.config(state="disabled")
+        manifest = AlbumManifest(self.output_dir) if self.skip_unchanged.get() else None
+        self.lookup_stats = dict(self.metadata.stats)
+        self.journal.begin([self.build_job(key) for key in self.to_convert])
+        self.runner = BatchRunner(self.worker_count.get(), self.post_job_event, self.post_job_result, manifest,
+                                  pipelined=not PROFILE, journal=self.journal)
         self.current_thread = threading.Thread(target=self.run_conversion)
         self.current_thread.start()
 
+    def next_job(self):
+        # Runs on the batch thread.
+        with self.queue_lock:
+            if self.cancel_all or not self.to_convert:
+                return None
+            key = self.to_convert.pop(0)
+            upcoming = self.to_convert[:PREFETCH_AHEAD]
+        self.events.post("dequeued", key)
+        self.metadata.prefetch([key + (self.album_paths[key],) for key in upcoming])
+        return self.build_job(key)
+
+    def build_job(self, key):
+        artist, album = key
+        settings = self.job_settings
+        gap_ms = GAP_DURATION_MS if self.gap_preferences.get(key, False) else 0
+        return make_job(artist, album, self.album_paths[key], self.output_dir,
+                        settings["bitrate"], settings["mode"], gap_ms, settings["in_artist_folder"],
+                        trace_dir=TRACE_DIR, profile=PROFILE, output_format=settings["format"],
+                        crossfade_ms=settings["crossfade_ms"], loudness=settings["loudness"],
+                        cover_path=self.metadata.art_file(artist, album))
+
+    def offer_resume(self):
+        # A batch that was interrupted (crash, power cut, closing mid-batch) left its
+        # journal behind: offer to queue the unfinished albums again with their settings.
+        jobs = self.journal.unfinished()
+        if not jobs:
+            return
+        if not messagebox.askyesno("Resume", f"{len(jobs)} album(s) from the last batch were not finished. "
+                                             "Resume converting them?"):
+            self.journal.clear()
+            return
+        first = jobs[0]
+        self.output_entry.delete(0, tk.END)
+        self.output_entry.insert(0, first["output_dir"])
+        self.bitrate.set(first["bitrate"])
+        self.pipeline_mode.set(first["mode"])
+        self.output_format.set(OUTPUT_FORMATS[first["format"]].label)
+        self.on_format_selected()
+        self.loudness_mode.set(first["loudness"])
+        self.smooth_seams.set(1 if first["crossfade_ms"] else 0)
+        in_artist_folder = os.path.dirname(first["output_path"]) != first["output_dir"]
+        self.save_in_artist_folder.set(1 if in_artist_folder else 0)
+        with self.queue_lock:
+            self.to_convert = [job["key"] for job in jobs]
+        for job in jobs:
+            self.album_paths[job["key"]] = job["album_path"]
+            self.gap_flags[job["key"]] = job["gap_ms"] > 0
+        self.refresh_album_queue()
+        self.start_conversion()
+
     def run_conversion(self):
-        while self.to_convert and not self.cancel_all:
-            artist, album = self.to_convert.pop(0)
-            self.update_album_lists()
-            self.display_album_art_and_fact(artist, album)
-            self.current_artist_label.config(text=artist)
-            self.current_album_label.config(text=album)
-            self.convert_album(artist, album)
-            self.current_artist_label.config(text="")
-            self.current_album_label.config(text="")
-            self.status_label.config(text="")
-            self.progress.stop()
-            if self.fact_cycle_job:
-                self.master.after_cancel(self.fact_cycle_job)
-                self.fact_cycle_job = None
+        # Runs on the batch thread: everything that touches Tk goes through self.events.
+        # batch_done is posted even if the batch dies, or Start would stay disabled.
+        try:
+            self.runner.run(self.next_job)
+        finally:
+            self.events.post("batch_done", self.runner.metrics(), self.runner.summary())
+
+    def post_job_event(self, key, kind, *values):
+        coalesce_key = ("progress", key) if kind == "progress" else None
+        self.events.post("job", key, kind, *values, coalesce_key=coalesce_key)
+
+    def post_job_result(self, job, result):
+        self.events.post("result", job, result)
+
+    def finish_batch(self, stage_metrics=(), summary=None):
+        self.runner = None
+        if not self.closing:
+            self.journal.clear()  # closing mid-batch keeps it, so the batch is offered again next time
+        self.current_key = None
+        self.job_progress = {}
+        self.current_artist_label.config(text="")
+        self.current_album_label.config(text="")
+        lines = [self.batch_summary(summary), self.pipeline_summary(stage_metrics)]
+        if self.batch_cancel_requested is not None:
+            lines.insert(0, f"Batch cancelled in {time.perf_counter() - self.batch_cancel_requested:.2f}s")
+            self.batch_cancel_requested = None
+        self.cancel_requested = {}
+        self.status_label.config(text="\n".join(line for line in lines if line))
+        self.progress.config(value=0)
+        if self.fact_cycle_job:
+            self.master.after_cancel(self.fact_cycle_job)
+            self.fact_cycle_job = None
         self.album_art_label.config(image='')
         self.album_fact_label.config(text="")
         self.current_album_img = None
+        self.start_button.config(state="normal")
+
+    def batch_summary(self, summary):
+        # Where the batch's time went, including the artwork/fact lookups made for it.
+        lookups = self.metadata.stats_since(self.lookup_stats)
+        if not summary or not summary["albums"]:
+            return ""
+        stages = summary["stages"]
+        parts = [f"{stage} {stages[stage]:.1f}s" for stage in ("scan", "decode", "encode", "art", "tag") if stage in stages]
+        parts.append(f"lookups {lookups['fetch_seconds']:.1f}s ({lookups['fetches']} fetched, "
+                     f"{lookups['cache_hits']} cached)")
+        text = f"{summary['albums']} album(s): " + ", ".join(parts)
+        print(f"Batch summary: {text}; tracks {summary['counters']}")
+        return text
+
+    def pipeline_summary(self, stage_metrics):
+        # Names the busiest stage so a slow disk or a slow encoder is easy to spot.
+        busy = [m for m in stage_metrics if m["albums"]]
+        if not busy:
+            return ""
+        slowest = max(busy, key=lambda m: m["busy_seconds"])
+        stages = ", ".join(f"{m['stage']} {m['utilization']:.0%}" for m in busy)
+        return f"Busiest stage: {slowest['stage']} ({stages})"
+
+    def handle_job_event(self, key, kind, *values):
+        if kind == "started":
+            self.job_progress[key] = (0, 0)
+            self.show_album(key)
+        elif kind == "status" and key == self.current_key:
+            self.status_label.config(text=values[0])
+        elif kind == "progress" and key in self.job_progress:
+            # Late updates from a job that already finished are ignored.
+            self.job_progress[key] = values
+            self.update_progress()
+
+    def show_album(self, key):
+        artist, album = key
+        self.current_key = key
+        self.clear_album_display()
+        self.current_artist_label.config(text=artist)
+        self.current_album_label.config(text=album)
+        future = self.metadata.lookup(artist, album, self.album_paths.get(key))
+        future.add_done_callback(lambda f, key=key: self.events.post("metadata", key, f))
+
+    def handle_job_result(self, job, result):
+        self.job_progress.pop(job["key"], None)
+        self.converted.append(result)
+        self.add_converted_entry(result)
+        self.update_progress()
+        requested = self.cancel_requested.pop(job["key"], None)
+        if requested is not None and not result["success"]:
+            self.status_label.config(
+                text=f"Cancelled {result['album']} in {(time.perf_counter() - requested) * 1000:.0f} ms")
+        elif job["key"] == self.current_key:
+            self.status_label.config(text="")
+        if job["key"] == self.current_key and self.job_progress:
+            # With several workers, switch to an album that is still converting.
+            self.show_album(next(iter(self.job_progress)))
+
+    def update_progress(self):
+        # Jobs report in their own units, so combine them as fractions of a whole album.
+        fractions = [done / total for done, total in self.job_progress.values() if total]
+        self.progress.config(maximum=max(1, len(self.job_progress)), value=sum(fractions))
 
-    def display_album_art_and_fact(self, artist, album):
+    def clear_album_display(self):
         self.album_art_label.config(image='')
         self.album_fact_label.config(text="")
         self.current_album_img = None
@@ -364,178 +732,29 @@ class AlbumConverterApp:
             self.master.after_cancel(self.fact_cycle_job)
             self.fact_cycle_job = None
 
-        art_found = False
-        fact_found = False
-
-        def set_album_image(img):
-            nonlocal art_found
-            if not art_found:
-                self.current_album_img = img
-                self.album_art_label.config(image=img)
-                art_found = True
+    def display_album_art_and_fact(self, key, future):
+        # Called whenever a lookup finishes; by then a different album may be on display.
+        if key != self.current_key:
+            return
+        try:
+            metadata = future.result()
+        except Exception as e:
+            print(f"Album info unavailable for {key[0]} - {key[1]}: {e}")
+            metadata = {"sentences": [], "art": None}
 
-        def set_album_facts(sentences):
-            cleaned = list(dict.fromkeys(sentences))  # remove duplicates
+        if metadata["sentences"]:
+            cleaned = list(dict.fromkeys(metadata["sentences"]))  # remove duplicates
             random.shuffle(cleaned)  # randomize order
             self.current_fact_sentences = cleaned
             self.fact_cycle_index = 0
             self.cycle_album_facts()
-
-
-        def try_wikipedia_summary(search_term):
-            nonlocal art_found, fact_found
-            url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{search_term.replace(' ', '_')}"
-            response = requests.get(url)
-            sentences = []
-            if response.status_code == 200:
-                data = response.json()
-                if 'thumbnail' in data and not art_found:
-                    try:
-                        img_url = data['thumbnail']['source']
-                        headers = {"User-Agent": "AlbumCombiner/1.0 (contact@example.com)"}
-                        img_resp = requests.get(img_url, headers=headers)
-                        img_resp.raise_for_status()
-                        img = Image.open(BytesIO(img_resp.content)).resize((400, 400))
-                        tk_img = ImageTk.PhotoImage(img)
-                        set_album_image(tk_img)
-                    except Exception as e:
-                        print(f"Could not load image from {img_url}: {e}")
-                if 'extract' in data and not fact_found:
-                    all_sentences = [s.strip() for s in data['extract'].replace('\n', ' ').split('.') if len(s.strip()) > 30]
-                    sentences = [s + '.' for s in all_sentences]
-                    if sentences:
-                        set_album_facts(sentences)
-                        fact_found = True
-                return 'thumbnail' in data or 'extract' in data
-            # If not found, do a search
-            search_url = f"https://en.wikipedia.org/w/api.php?action=query&list=search&srsearch={requests.utils.quote(search_term)}&format=json"
-            search_resp = requests.get(search_url)
-            if search_resp.status_code == 200:
-                search_data = search_resp.json()
-                if search_data.get("query", {}).get("search"):
-                    best_title = search_data["query"]["search"][0]["title"]
-                    url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{best_title.replace(' ', '_')}"
-                    response = requests.get(url)
-                    if response.status_code == 200:
-                        data = response.json()
-                        if 'thumbnail' in data and not art_found:
-                            try:
-                                img_url = data['thumbnail']['source']
-                                headers = {"User-Agent": "AlbumCombiner/1.0 (contact@example.com)"}
-                                img_resp = requests.get(img_url, headers=headers)
-                                img_resp.raise_for_status()
-                                img = Image.open(BytesIO(img_resp.content)).resize((400, 400))
-                                tk_img = ImageTk.PhotoImage(img)
-                                self.album_art_label.config(image=tk_img)
-                                self.current_album_img = tk_img
-                                art_found = True
-                            except Exception as e:
-                                print(f"Could not load image from {img_url}: {e}")
-                        if 'extract' in data and not fact_found:
-                            all_sentences = [s.strip() for s in data['extract'].replace('\n', ' ').split('.') if len(s.strip()) > 30]
-                            sentences = [s + '.' for s in all_sentences]
-                            if sentences:
-                                set_album_facts(sentences)
-                                fact_found = True
-                        return 'thumbnail' in data or 'extract' in data
-            return False
-
-        def try_wikipedia_band_overview(band):
-            nonlocal fact_found
-            url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{band.replace(' ', '_')}"
-            response = requests.get(url)
-            if response.status_code == 200 and not fact_found:
-                data = response.json()
-                if 'extract' in data:
-                    all_sentences = [s.strip() for s in data['extract'].replace('\n', ' ').split('.') if len(s.strip()) > 30]
-                    sentences = [s + '.' for s in all_sentences]
-                    if sentences:
-                        set_album_facts(sentences)
-                        fact_found = True
-                else:
-                    set_album_facts([])
-            else:
-                set_album_facts([])
-
-        def try_musicbrainz_and_caa(artist, album):
-            nonlocal art_found, fact_found
-            try:
-                query = f'releasegroup:"{album}" AND artist:"{artist}"'
-                mb_url = f"https://musicbrainz.org/ws/2/release-group/?query={requests.utils.quote(query)}&fmt=json"
-                mb_resp = requests.get(mb_url, headers={"User-Agent": "AlbumCombiner/1.0 (contact@example.com)"})
-                if mb_resp.status_code != 200:
-                    return False
-                mb_data = mb_resp.json()
-                if not mb_data.get("release-groups"):
-                    return False
-                rg = mb_data["release-groups"][0]
-                rgid = rg["id"]
-                caa_url = f"https://coverartarchive.org/release-group/{rgid}/front-500"
-                caa_resp = requests.get(caa_url)
-                if caa_resp.status_code == 200 and not art_found:
-                    img = Image.open(BytesIO(caa_resp.content)).resize((400, 400))
-                    tk_img = ImageTk.PhotoImage(img)
-                    set_album_image(tk_img)
-                if not fact_found:
-                    fact = rg.get("disambiguation") or rg.get("first-release-date", "")
-                    if not fact:
-                        fact = f"{album} is an album by {artist}."
-                    set_album_facts([fact])
-                    fact_found = True
-                if art_found or fact_found:
-                    return True
-                else:
-                    try_wikipedia_band_overview(artist)
-                    return True
-            except Exception as e:
-                print("MusicBrainz/CoverArtArchive error:", e)
-                return False
-
-        all_sentences = []
-
-        # Try Wikipedia: album name
-        url_album = f"https://en.wikipedia.org/api/rest_v1/page/summary/{album.replace(' ', '_')}"
-        resp_album = requests.get(url_album)
-        if resp_album.status_code == 200:
-            data = resp_album.json()
-            if 'extract' in data:
-                all_sentences += extract_sentences(data['extract'])
-            if 'thumbnail' in data and not art_found:
-                try:
-                    img_url = data['thumbnail']['source']
-                    headers = {"User-Agent": "AlbumCombiner/1.0 (contact@example.com)"}
-                    img_resp = requests.get(img_url, headers=headers)
-                    img_resp.raise_for_status()
-                    img = Image.open(BytesIO(img_resp.content)).resize((400, 400))
-                    tk_img = ImageTk.PhotoImage(img)
-                    self.album_art_label.config(image=tk_img)
-                    self.current_album_img = tk_img
-                    art_found = True
-                except Exception as e:
-                    print(f"Could not load image from {img_url}: {e}")
-
-
-        # Try Wikipedia: "Artist Album"
-        url_combo = f"https://en.wikipedia.org/api/rest_v1/page/summary/{(artist + ' ' + album).replace(' ', '_')}"
-        resp_combo = requests.get(url_combo)
-        if resp_combo.status_code == 200:
-            data = resp_combo.json()
-            if 'extract' in data:
-                all_sentences += extract_sentences(data['extract'])
-
-        # Try Wikipedia: artist name
-        url_artist = f"https://en.wikipedia.org/api/rest_v1/page/summary/{artist.replace(' ', '_')}"
-        resp_artist = requests.get(url_artist)
-        if resp_artist.status_code == 200:
-            data = resp_artist.json()
-            if 'extract' in data:
-                all_sentences += extract_sentences(data['extract'])
-
-        if all_sentences:
-            set_album_facts(all_sentences)
         else:
             self.album_fact_label.config(text="")
-        if not art_found:
+        if metadata["art"] is not None:
+            tk_img = ImageTk.PhotoImage(metadata["art"])
+            self.album_art_label.config(image=tk_img)
+            self.current_album_img = tk_img
+        else:
             self.show_no_art_placeholder()
 
 
@@ -549,85 +768,34 @@ class AlbumConverterApp:
         self.fact_cycle_job = self.master.after(8000, self.cycle_album_facts)  # 8 seconds
 
 
-    def convert_album(self, artist, album):
-        root_dir = self.input_entry.get().strip()
-        album_path = os.path.join(root_dir, artist, album)
-        files = sorted(os.listdir(album_path))
-        self.cancel_current = False
-
-        self.status_label.config(text="Processing Audio")
-
-        supported = [f for f in files if is_valid_audio_file(os.path.join(album_path, f))]
-        if not supported:
-            self.converted.append((artist, album, False, "", None))
-            self.update_album_lists()
-            return
-
-        self.progress.config(maximum=len(supported), value=0)
-        combined = AudioSegment.empty()
-        insert_gap = self.gap_preferences.get((artist, album), False)
-
-        for i, filename in enumerate(files):
-            path = os.path.join(album_path, filename)
-            if not os.path.isfile(path):
-                continue
-            if not is_valid_audio_file(path):
-                continue
-            if self.cancel_current:
-                self.converted.append((artist, album, False, "", None))
-                self.update_album_lists()
-                return
-            audio = safe_audio_segment(path)
-            if audio:
-                combined += audio
-                if insert_gap:
-                    combined += AudioSegment.silent(duration=GAP_DURATION_MS)
-            self.progress.config(value=i+1)
-
-        if self.save_in_artist_folder.get():
-            artist_folder = os.path.join(self.output_dir, artist)
-            os.makedirs(artist_folder, exist_ok=True)
-            output_path = os.path.join(artist_folder, f"{album}.mp3")
-        else:
-            output_path = os.path.join(self.output_dir, f"{artist} - {album}.mp3")
-
-        try:
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            combined.export(output_path, format="mp3", bitrate=self.bitrate.get())
-            duration = len(combined)
-            minutes = duration // 60000
-            seconds = (duration % 60000) // 1000
-            duration_str = f"{minutes}:{seconds:02}"
-            size_mb = os.path.getsize(output_path) / (1024 * 1024)
-            mp3 = MP3(output_path, ID3=EasyID3)
-            mp3["artist"] = artist
-            mp3["album"] = album
-            mp3["title"] = f"{album} (Full Album)"
-            mp3.save()
-            self.converted.append((artist, album, True, duration_str, size_mb))
-        except Exception as e:
-            print(f"Export failed: {e}")
-            self.converted.append((artist, album, False, "", None))
-        self.update_album_lists()
-        self.progress.config(value=0)
-        self.status_label.config(text="")
-
     def on_close(self):
+        busy = self.current_thread is not None and self.current_thread.is_alive()
+        if busy and not messagebox.askyesno("Exit", "Conversion in progress. Cancel and exit?\n"
+                                                    "Unfinished albums will be offered again next time."):
+            return
         if self.fact_cycle_job:
             self.master.after_cancel(self.fact_cycle_job)
             self.fact_cycle_job = None
-        if self.current_thread and self.current_thread.is_alive():
-            if messagebox.askyesno("Exit", "Conversion in progress. Cancel and exit?"):
-                self.cancel_current = True
-                self.cancel_all = True
-                self.to_convert.clear()
-                self.master.after(1000, self.master.destroy)
-            else:
-                self.master.destroy()
+        if busy:
+            # Cancelling kills the ffmpeg children, so the batch thread ends almost at once;
+            # wait for it rather than leaving it running behind a destroyed window.
+            self.closing = True
+            self.close_deadline = time.monotonic() + CLOSE_TIMEOUT_SECONDS
+            self.cancel_batch()
+            self.close_when_idle()
         else:
+            self.metadata.shutdown()
             self.master.destroy()
 
+    def close_when_idle(self):
+        if self.current_thread.is_alive() and time.monotonic() < self.close_deadline:
+            self.master.after(50, self.close_when_idle)
+            return
+        self.metadata.shutdown()
+        self.master.destroy()
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = AlbumConverterApp(root)
     root.geometry("1250x850")
@@ -0,0 +1,297 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pydub import AudioSegment
+from pydub.generators import Sine, WhiteNoise
+from album_engine import (
+    BITRATES, PIPELINE_MODES, DECODE_THREADS, OUTPUT_FORMATS, DEFAULT_FORMAT, MEMORY_BUDGET_MB, AlbumAssembler,
+    BatchRunner, CancelToken,
+    LibraryScanner, album_layout, build_output_path, decode_track, encode_pcm, list_album_files, make_job,
+    probe_track, tag_output,
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Reproducible timings for the conversion engine. Builds a synthetic library with the
+# same pydub/ffmpeg stack the converter uses, then times each stage album by album and a
+# whole batch through BatchRunner. Results are one JSON document so runs can be compared
+# with --baseline. Everything is local: network access is blocked for the whole run, and
+# only the engine is loaded, so no artwork or fact lookups happen.
+
+# pydub export arguments per generated format.
+FORMATS = {
+    "mp3": {"format": "mp3", "bitrate": "192k"},
+    "flac": {"format": "flac"},
+    "wav": {"format": "wav"},
+    "ogg": {"format": "ogg", "codec": "libvorbis"},
+    "m4a": {"format": "ipod", "codec": "aac"},
+}
+JUNK_FILES = {
+    "folder.jpg": b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + bytes(4096),
+    "cover.png": b"\x89PNG\r\n\x1a\n" + bytes(2048),
+    "rip.log": b"Exact Audio Copy V1.0\r\n" * 40,
+    "album.cue": b'FILE "album.wav" WAVE\r\n  TRACK 01 AUDIO\r\n',
+    "notes.txt": b"Ripped for benchmarking.\n",
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the album conversion engine on a synthetic library.")
+    parser.add_argument("--artists", type=int, default=2)
+    parser.add_argument("--albums", type=int, default=2, help="Albums per artist")
+    parser.add_argument("--tracks", type=int, default=6, help="Tracks per album")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Length of each track")
+    parser.add_argument("--formats", default="mp3,flac",
+                        help=f"Comma-separated source formats to cycle through ({', '.join(FORMATS)})")
+    parser.add_argument("--mixed", action="store_true",
+                        help="Mix formats and sample rates within each album instead of per album")
+    parser.add_argument("--discs", action="store_true", help="Split every album into CD1/CD2 folders")
+    parser.add_argument("--no-junk", action="store_true", help="Leave out folder.jpg, .log, .cue and other extras")
+    parser.add_argument("--mode", choices=PIPELINE_MODES, default=PIPELINE_MODES[0])
+    parser.add_argument("--bitrate", default=BITRATES[1])
+    parser.add_argument("--output-format", choices=list(OUTPUT_FORMATS), default=DEFAULT_FORMAT)
+    parser.add_argument("--workers", type=int, default=1, help="Albums converted in parallel in the batch run")
+    parser.add_argument("--decode-threads", type=int, default=DECODE_THREADS)
+    parser.add_argument("--memory-budget", type=int, default=MEMORY_BUDGET_MB, metavar="MB",
+                        help="Memory mode spools albums above this to disk in the batch run (0 spools every album)")
+    parser.add_argument("--library", help="Reuse (or keep) the synthetic library in this folder")
+    parser.add_argument("--skip-batch", action="store_true", help="Only run the per-stage measurements")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier JSON results to compare against (printed to stderr)")
+    return parser.parse_args(argv)
+
+
+def block_network():
+    # The engine never goes online; make sure nothing slips in and skews the timings. Only
+    # internet sockets are refused: the worker pool's manager talks over a local socket.
+    connect = socket.socket.connect
+
+    def refuse_internet(sock, address):
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            raise OSError("network access is disabled while benchmarking")
+        return connect(sock, address)
+    socket.socket.connect = refuse_internet
+
+
+def synthetic_track(seed, seconds, frame_rate):
+    # A tone plus a little noise, so lossy encoders have real work to do.
+    duration_ms = int(seconds * 1000)
+    tone = Sine(110 + 37 * (seed % 20), sample_rate=frame_rate).to_audio_segment(duration=duration_ms, volume=-12)
+    noise = WhiteNoise(sample_rate=frame_rate).to_audio_segment(duration=duration_ms, volume=-35)
+    return tone.overlay(noise).set_channels(2)
+
+
+def generate_library(root, args):
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        raise SystemExit(f"Unknown format(s): {', '.join(unknown)}")
+    seed = 0
+    for a in range(args.artists):
+        for b in range(args.albums):
+            album_dir = os.path.join(root, f"Artist {a + 1:02d}", f"Album {b + 1:02d}")
+            for t in range(args.tracks):
+                seed += 1
+                if args.mixed:
+                    fmt, frame_rate = formats[t % len(formats)], (44100, 48000)[t % 2]
+                else:
+                    fmt, frame_rate = formats[(a * args.albums + b) % len(formats)], 44100
+                folder = album_dir
+                if args.discs:
+                    folder = os.path.join(album_dir, f"CD{1 + t * 2 // args.tracks}")
+                os.makedirs(folder, exist_ok=True)
+                path = os.path.join(folder, f"{t + 1:02d} Track {t + 1}.{fmt}")
+                synthetic_track(seed, args.seconds, frame_rate).export(path, **FORMATS[fmt])
+            if not args.no_junk:
+                for name, data in JUNK_FILES.items():
+                    with open(os.path.join(album_dir, name), "wb") as f:
+                        f.write(data)
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process and of the largest ffmpeg/ffprobe child.
+    if resource is None:
+        return None, None
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB elsewhere
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / divisor, 1), round(children / divisor, 1)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0, "total": 0.0, "mean": 0.0, "max": 0.0}
+    return {
+        "count": len(samples),
+        "total": round(sum(samples), 4),
+        "mean": round(sum(samples) / len(samples), 4),
+        "max": round(max(samples), 4),
+    }
+
+
+def measure_stages(albums, output_dir, args):
+    # One album at a time, one track at a time, so every stage is timed on its own.
+    probe, decode, assemble, encode, tag = [], [], [], [], []
+    audio_seconds = 0.0
+    output_bytes = 0
+    for artist, album, album_path in albums:
+        tracks = []
+        for entry in list_album_files(album_path):
+            track, seconds = timed(probe_track, entry.path, entry.stat().st_size)
+            probe.append(seconds)
+            if track:
+                tracks.append(track)
+        if not tracks:
+            continue
+        frame_rate, channels = album_layout(tracks)
+        assembler = AlbumAssembler(frame_rate, channels, expected_ms=sum(t.duration_ms for t in tracks))
+        assemble_seconds = 0.0
+        for track in tracks:
+            segment, seconds = timed(decode_track, track, frame_rate, channels)
+            decode.append(seconds)
+            _, seconds = timed(assembler.add, segment)
+            assemble_seconds += seconds
+        combined, seconds = timed(assembler.finish)
+        assemble.append(assemble_seconds + seconds)
+        audio_seconds += len(combined) / 1000
+        output_path = build_output_path(output_dir, artist, album, False, args.output_format)
+        pcm = combined.raw_data
+        _, seconds = timed(encode_pcm, pcm, len(pcm), combined.frame_rate, combined.channels, output_path,
+                           args.bitrate, args.output_format, on_progress=lambda done, total: None,
+                           cancel=CancelToken())
+        encode.append(seconds)
+        output_bytes += os.path.getsize(output_path)
+        _, seconds = timed(tag_output, output_path, artist, album)
+        tag.append(seconds)
+    return {
+        "probe_per_file": summarize(probe),
+        "decode_per_track": summarize(decode),
+        "assemble_per_album": summarize(assemble),
+        "encode_per_album": summarize(encode),
+        "tag_per_album": summarize(tag),
+        "encode_realtime_factor": round(audio_seconds / sum(encode), 1) if encode and sum(encode) else None,
+        "output_mb": round(output_bytes / (1024 * 1024), 2),
+    }
+
+
+def measure_batch(albums, output_dir, args):
+    jobs = iter([make_job(artist, album, album_path, output_dir, args.bitrate, args.mode,
+                          decode_threads=args.decode_threads, output_format=args.output_format,
+                          memory_budget_mb=args.memory_budget)
+                 for artist, album, album_path in albums])
+    results = []
+    runner = BatchRunner(args.workers, lambda *event: None, lambda job, result: results.append(result))
+    _, seconds = timed(runner.run, lambda: next(jobs, None))
+    converted = sum(1 for r in results if r["success"])
+    return {
+        "mode": args.mode,
+        "workers": args.workers,
+        "seconds": round(seconds, 3),
+        "converted": converted,
+        "failed": len(results) - converted,
+        "albums_per_minute": round(converted * 60 / seconds, 2) if seconds else 0.0,
+        "stages": runner.metrics(),
+    }
+
+
+def ffmpeg_version():
+    try:
+        out = subprocess.run([AudioSegment.converter, "-version"], capture_output=True, text=True).stdout
+        return out.splitlines()[0] if out else None
+    except OSError:
+        return None
+
+
+def flatten(data, prefix=""):
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = flatten(json.load(f))
+    current = flatten(results)
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name], current[name]
+        if before and before != after:
+            print(f"{name}: {before} -> {after} ({(after - before) / before:+.1%})", file=sys.stderr)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    block_network()
+    work_dir = tempfile.mkdtemp(prefix="album_bench_")
+    try:
+        library = args.library or os.path.join(work_dir, "library")
+        generate_seconds = None
+        if not os.path.isdir(library) or not os.listdir(library):
+            print(f"Generating synthetic library in {library}", file=sys.stderr)
+            _, generate_seconds = timed(generate_library, library, args)
+
+        scanner = LibraryScanner(snapshot_dir=os.path.join(work_dir, "snapshots"))
+        cold = scanner.scan(library, use_snapshot=False)
+        warm = scanner.scan(library)
+        results = {
+            "machine": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "ffmpeg": ffmpeg_version(),
+            },
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "library")},
+            "library": {
+                "albums": len(cold.albums),
+                "files": cold.file_count,
+                "folders": cold.dir_count,
+                "generate_seconds": round(generate_seconds, 3) if generate_seconds else None,
+            },
+            "scan": {"cold_seconds": round(cold.seconds, 4), "snapshot_seconds": round(warm.seconds, 4)},
+        }
+
+        stage_dir = os.path.join(work_dir, "stages")
+        os.makedirs(stage_dir)
+        results["stages"] = measure_stages(cold.albums, stage_dir, args)
+        if not args.skip_batch:
+            results["batch"] = measure_batch(cold.albums, os.path.join(work_dir, "batch"), args)
+        own, children = peak_rss_mb()
+        results["peak_rss_mb"] = {"process": own, "children": children}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
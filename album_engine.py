@@ -0,0 +1,2095 @@
+import base64
+import bisect
+import cProfile
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import multiprocessing
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from array import array
+from collections import namedtuple
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError, CouldntEncodeError
+from pydub.utils import mediainfo_json
+import mutagen
+from mutagen.easyid3 import EasyID3
+from mutagen.easymp4 import EasyMP4Tags
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import ID3, APIC
+from mutagen.mp4 import MP4, MP4Cover
+
+try:
+    import numpy as np
+except ImportError:  # only needed to crossfade gapless seams
+    np = None
+
+# Conversion engine shared by the GUI and the command line. It must not import tkinter,
+# PIL or requests so headless batch runs stay light. Diagnostics go to stderr, which keeps
+# stdout free for the CLI's --json progress stream.
+
+GAP_DURATION_MS = 1000
+BITRATES = ["128k", "192k", "256k", "320k"]
+# "memory" assembles the whole album as PCM before encoding; "stream" pipes each track
+# into a single ffmpeg encoder and keeps only one decoded track in memory. "copy" joins
+# MP3 frames without re-encoding when every track shares one format, otherwise it transcodes.
+PIPELINE_MODES = ["memory", "stream", "copy"]
+# Albums converted at once, each in its own process. Memory mode holds a whole album per
+# worker, so the default stays modest even on machines with many cores.
+MAX_WORKERS = os.cpu_count() or 1
+DEFAULT_WORKERS = min(4, MAX_WORKERS)
+# Albums allowed to wait between two pipeline stages when converting one album at a time:
+# the next album is decoded while the current one encodes, but never further ahead (the
+# decode stage also waits for a slot, so at most this many decoded albums wait for encode).
+PIPELINE_QUEUE_SIZE = 1
+# Memory mode keeps an album's PCM in RAM up to this size (44.1 kHz stereo is ~600 MB an
+# hour); larger albums are spooled to a memory-mapped file next to the output instead.
+MEMORY_BUDGET_MB = 2048
+# Tracks of one album decoded at the same time (each decode is its own ffmpeg process).
+DECODE_THREADS = min(4, MAX_WORKERS)
+# Directories listed at the same time while scanning a library; this is I/O bound, so it
+# helps most on network shares.
+SCAN_THREADS = 16
+# Kept in the output folder; remembers what every output file was built from.
+MANIFEST_NAME = ".album_combiner_manifest.json"
+
+# Files whose extension or first bytes are obviously not audio are never handed to
+# ffprobe, so cover art, cue sheets and rip logs never cost a process launch. Anything
+# else, including formats missing from AUDIO_EXTENSIONS, is left for ffprobe to judge.
+AUDIO_EXTENSIONS = {
+    ".mp3", ".mp2", ".flac", ".wav", ".m4a", ".m4b", ".mp4", ".aac", ".alac", ".ogg", ".oga",
+    ".opus", ".wma", ".aif", ".aiff", ".aifc", ".ape", ".wv", ".tta", ".mpc", ".mka", ".webm",
+    ".ac3", ".dts", ".caf", ".au", ".amr", ".dsf", ".dff", ".tak", ".w64", ".shn", ".ofr",
+}
+NON_AUDIO_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp", ".ico", ".txt", ".nfo",
+    ".log", ".cue", ".m3u", ".m3u8", ".pls", ".pdf", ".sfv", ".md5", ".ffp", ".accurip", ".db",
+    ".ini", ".url", ".lnk", ".htm", ".html", ".xml", ".json", ".doc", ".docx", ".rtf", ".zip",
+    ".rar", ".7z", ".exe",
+}
+NON_AUDIO_MAGIC = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"%PDF", b"PK\x03\x04", b"Rar!", b"7z\xbc\xaf",
+                   b"II*\x00", b"MM\x00*", b"\x1f\x8b", b"MZ")
+
+# Sub-folders such as "CD1", "Disc 2" or "CD 1 - Live" are parts of the album above them.
+DISC_FOLDER = re.compile(r"^(cd|disc|disk)\s*[-_.]?\s*(\d+)\b", re.IGNORECASE)
+
+# Albums are likely duplicates when they have as many tracks and every track's length
+# agrees within this many seconds (different rips differ by a few frames of padding).
+DUPLICATE_TOLERANCE_SECONDS = 2.0
+# Singles and two-track releases match by length alone far too easily; they are only
+# called copies when the quick audio hash agrees as well.
+DUPLICATE_MIN_TRACKS = 3
+# The optional quick audio hash: the energy contour of a few seconds of the first track,
+# decoded at a low rate so MP3 and FLAC copies of one rip still compare equal.
+QUICK_HASH_SECONDS = 12
+# Where the hashed stretch starts. The same for every album, so copies whose first tracks
+# differ by a second of padding still hash the same audio; short enough that any real
+# track (however brief) reaches it, and past the silence most intros open with.
+QUICK_HASH_OFFSET_SECONDS = 10.0
+QUICK_HASH_BLOCK_MS = 250
+QUICK_HASH_RATE = 8000
+# Share of the hash bits allowed to differ between two copies of the same recording.
+QUICK_HASH_MAX_DIFFERENCE = 0.25
+FINGERPRINT_THREADS = 8
+# mutagen file types (and ffprobe codecs) that hold lossless audio; a lossless copy is
+# always preferred over a lossy one when picking the best of several duplicates.
+LOSSLESS_TYPES = {"FLAC", "WAVE", "AIFF", "MonkeysAudio", "WavPack", "TrueAudio", "OptimFROG"}
+LOSSLESS_CODECS = {"flac", "alac", "ape", "wavpack", "tta", "mlp", "truehd"}
+
+# Cover art embedded in the output. Local images are tried in this order of file name
+# (then a lone image of any name); a remote cover from the GUI's cache is the fallback.
+# Files over COVER_MAX_BYTES are scaled down to COVER_MAX_PIXELS and re-encoded as JPEG.
+COVER_NAMES = ("cover", "folder", "front", "albumart", "album")
+COVER_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+COVER_MAX_BYTES = 512 * 1024
+COVER_MAX_PIXELS = 1000
+
+# Output presets. Presets without a `kbps` use the chosen bitrate; the others have a fixed
+# quality (LAME VBR levels, lossless FLAC) and `kbps` is only a typical rate for estimates.
+OutputFormat = namedtuple("OutputFormat", ["label", "extension", "container", "codec", "args", "kbps"])
+OUTPUT_FORMATS = {
+    "mp3": OutputFormat("MP3 (CBR)", ".mp3", "mp3", "libmp3lame", [], None),
+    "mp3-v0": OutputFormat("MP3 V0 (VBR ~245k)", ".mp3", "mp3", "libmp3lame", ["-q:a", "0"], 245),
+    "mp3-v2": OutputFormat("MP3 V2 (VBR ~190k)", ".mp3", "mp3", "libmp3lame", ["-q:a", "2"], 190),
+    "mp3-v4": OutputFormat("MP3 V4 (VBR ~165k)", ".mp3", "mp3", "libmp3lame", ["-q:a", "4"], 165),
+    "opus": OutputFormat("Opus", ".opus", "opus", "libopus", [], None),
+    "aac": OutputFormat("AAC (M4A)", ".m4a", "ipod", "aac", [], None),
+    "flac": OutputFormat("FLAC (lossless)", ".flac", "flac", "flac", [], 900),
+}
+DEFAULT_FORMAT = "mp3"
+
+# "album" applies one gain to the whole output, "track" levels every track separately and
+# "tags" only writes ReplayGain tags for players to apply. All need numpy.
+LOUDNESS_MODES = ["off", "album", "track", "tags"]
+# ReplayGain 2.0 reference level.
+LOUDNESS_TARGET_LUFS = -18.0
+REPLAYGAIN_KEYS = ["replaygain_track_gain", "replaygain_track_peak", "replaygain_album_gain", "replaygain_album_peak"]
+# Written as TXXX frames / freeform atoms, which is what players read, instead of RVA2.
+for _key in REPLAYGAIN_KEYS:
+    EasyID3.RegisterTXXXKey(_key, _key.upper())
+    EasyMP4Tags.RegisterFreeformKey(_key, _key.upper())
+
+# MPEG decoders output 529 samples of their own before the encoder's priming samples.
+MP3_DECODER_DELAY = 529
+ITUNSMPB_KEY = "----:com.apple.iTunes:iTunSMPB"
+
+# `gapless` is (priming, padding, valid_samples) from the LAME or iTunSMPB header, if any.
+TrackInfo = namedtuple("TrackInfo", ["path", "size", "duration_ms", "codec", "sample_rate", "channels", "bit_rate",
+                                     "gapless"], defaults=(None,))
+
+
+def app_data_dir():
+    # Per-user folder for caches and state that should survive between runs.
+    base = (os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"))
+    path = os.path.join(base, "AlbumCombiner")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def sniff_non_audio(head):
+    if head.startswith(NON_AUDIO_MAGIC):
+        return True
+    return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+
+
+def looks_like_audio(file_path):
+    # Only rules out the obvious; unknown extensions (.dsf, .tak, ...) still get probed.
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in NON_AUDIO_EXTENSIONS:
+        return False
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(12)
+    except OSError:
+        return False
+    return bool(head) and not sniff_non_audio(head)
+
+
+def to_number(value, cast=float, default=0):
+    try:
+        return cast(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def probe_track(file_path, size=None):
+    if not looks_like_audio(file_path):
+        return None
+    try:
+        info = mediainfo_json(file_path)
+    except Exception as e:
+        print(f"Skipping {file_path}: {e}", file=sys.stderr)
+        return None
+    streams = [s for s in info.get("streams", []) if s.get("codec_type") == "audio"]
+    if not streams:
+        return None
+    stream = streams[0]
+    fmt = info.get("format", {})
+    duration = to_number(stream.get("duration")) or to_number(fmt.get("duration"))
+    if duration <= 0:
+        return None
+    if size is None:
+        size = os.path.getsize(file_path)
+    return TrackInfo(
+        path=file_path,
+        size=size,
+        duration_ms=int(duration * 1000),
+        codec=stream.get("codec_name", ""),
+        sample_rate=to_number(stream.get("sample_rate"), int, 44100),
+        channels=to_number(stream.get("channels"), int, 2),
+        bit_rate=to_number(stream.get("bit_rate"), int) or to_number(fmt.get("bit_rate"), int),
+        gapless=read_gapless_info(file_path, stream.get("codec_name", "")),
+    )
+
+
+def parse_itunsmpb(value):
+    # " 00000000 00000840 000001CA 0000000000A1B2C3 ...": priming, padding, valid samples.
+    fields = value.split()
+    if len(fields) < 4:
+        return None
+    return int(fields[1], 16), int(fields[2], 16), int(fields[3], 16)
+
+
+def read_lame_gapless(file_path):
+    # The LAME tag lives in the Xing/Info frame in front of the audio: a frame count, then
+    # 12 bits of encoder delay and 12 bits of padding 21 bytes into the LAME extension.
+    with open(file_path, "rb") as f:
+        head = f.read(10)
+        offset = 0
+        if head[:3] == b"ID3" and len(head) == 10:
+            offset = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9])
+            if head[5] & 0x10:
+                offset += 10
+        f.seek(offset)
+        frame = f.read(512)
+    if len(frame) < 4 or frame[0] != 0xFF or frame[1] & 0xE0 != 0xE0:
+        return None
+    mpeg1 = (frame[1] >> 3) & 3 == 3
+    mono = (frame[3] >> 6) & 3 == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    pos = 4 + side_info
+    if frame[pos:pos + 4] not in (b"Xing", b"Info"):
+        return None
+    flags = int.from_bytes(frame[pos + 4:pos + 8], "big")
+    pos += 8
+    if not flags & 1:
+        return None
+    frames = int.from_bytes(frame[pos:pos + 4], "big")
+    pos += 4 + (4 if flags & 2 else 0) + (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+    lame = frame[pos:pos + 24]
+    if len(lame) < 24 or not lame[:4].isalpha():
+        return None
+    delay = (lame[21] << 4) | (lame[22] >> 4)
+    padding = ((lame[22] & 0x0F) << 8) | lame[23]
+    if not delay and not padding:
+        return None
+    valid = frames * (1152 if mpeg1 else 576) - delay - padding
+    return delay + MP3_DECODER_DELAY, max(0, padding - MP3_DECODER_DELAY), valid
+
+
+def read_gapless_info(file_path, codec):
+    try:
+        if codec == "mp3":
+            return read_lame_gapless(file_path)
+        if codec == "aac" and os.path.splitext(file_path)[1].lower() in (".m4a", ".m4b", ".mp4"):
+            tags = MP4(file_path).tags
+            value = tags.get(ITUNSMPB_KEY) if tags else None
+            return parse_itunsmpb(bytes(value[0]).decode("ascii", "ignore")) if value else None
+    except (OSError, ValueError, mutagen.MutagenError) as e:
+        print(f"No gapless info for {file_path}: {e}", file=sys.stderr)
+    return None
+
+
+def gapless_bounds(track, frames, frame_rate):
+    # (first, end) frames to keep from a decode of `frames` frames. Depending on the build,
+    # ffmpeg may already have dropped the priming (and padding), so only the excess over
+    # the valid length is trimmed: priming first when both are still there, else padding.
+    # An excess that does not fit the header means the header is wrong; keep everything.
+    if track.gapless is None:
+        return 0, frames
+    priming, padding, valid = (int(n * frame_rate / track.sample_rate) for n in track.gapless)
+    excess = frames - valid
+    if excess <= 0 or excess > priming + padding + 1152:
+        return 0, frames
+    lead = priming if excess >= priming + padding else 0
+    return lead, frames - (excess - lead)
+
+
+def disc_number(name):
+    match = DISC_FOLDER.match(name)
+    return int(match.group(2)) if match else None
+
+
+def list_album_files(album_path):
+    # Files of the album folder itself, followed by those of its disc folders in disc order.
+    with os.scandir(album_path) as it:
+        entries = list(it)
+    files = sorted((e for e in entries if e.is_file()), key=lambda e: e.name)
+    discs = sorted((e for e in entries if e.is_dir() and disc_number(e.name) is not None),
+                   key=lambda e: (disc_number(e.name), e.name))
+    for disc in discs:
+        with os.scandir(disc.path) as it:
+            files += sorted((e for e in it if e.is_file()), key=lambda e: e.name)
+    return files
+
+
+def scan_album_tracks(album_path, trace=None):
+    tracks = []
+    for entry in list_album_files(album_path):
+        start = time.perf_counter()
+        track = probe_track(entry.path, entry.stat().st_size)
+        if trace is not None:
+            trace.count("files")
+            if track:
+                trace.track(entry.path, "probe", time.perf_counter() - start)
+        if track:
+            tracks.append(track)
+    return tracks
+
+
+def album_layout(tracks):
+    # Every track is decoded straight into the richest layout found on the album,
+    # so joining never has to resample afterwards.
+    return max(t.sample_rate for t in tracks), max(t.channels for t in tracks)
+
+
+class CancelToken:
+    # One album's cancel flag. Stages poll is_set() between units of work, and every ffmpeg
+    # child is registered so set() can kill it mid-track or mid-encode instead of waiting
+    # for it to finish. In a worker process the flag is a manager Event set by the parent;
+    # watch() mirrors it there from a background thread.
+    POLL_SECONDS = 0.05
+
+    def __init__(self, event=None):
+        self.event = event if event is not None else threading.Event()
+        self.children = set()
+        self.lock = threading.Lock()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def set(self):
+        self.event.set()
+        self.kill_children()
+
+    def register(self, proc):
+        with self.lock:
+            self.children.add(proc)
+        if self.is_set():  # cancelled while the process was starting
+            proc.kill()
+
+    def unregister(self, proc):
+        with self.lock:
+            self.children.discard(proc)
+
+    def kill_children(self):
+        with self.lock:
+            children = list(self.children)
+        for proc in children:
+            if proc.poll() is None:
+                proc.kill()
+
+    @contextmanager
+    def watch(self):
+        finished = threading.Event()
+
+        def poll():
+            while not finished.is_set():
+                if self.event.wait(self.POLL_SECONDS):
+                    self.kill_children()
+                    return
+
+        threading.Thread(target=poll, daemon=True).start()
+        try:
+            yield self
+        finally:
+            finished.set()
+
+
+def run_child(command, cancel=None):
+    # subprocess.run that a CancelToken can kill.
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if cancel is not None:
+        cancel.register(proc)
+    try:
+        stdout, stderr = proc.communicate()
+    finally:
+        if cancel is not None:
+            cancel.unregister(proc)
+    return subprocess.CompletedProcess(command, proc.returncode, stdout, stderr)
+
+
+def decode_track(track, frame_rate=None, channels=None, cancel=None):
+    # Decode straight to 16-bit PCM with the probed layout; AudioSegment.from_file would
+    # launch a second ffprobe for the same file.
+    frame_rate = frame_rate or track.sample_rate
+    channels = channels or track.channels
+    command = [
+        AudioSegment.converter, "-v", "error", "-i", track.path, "-vn",
+        "-ac", str(channels), "-ar", str(frame_rate),
+        "-f", "s16le", "-acodec", "pcm_s16le", "-",
+    ]
+    proc = run_child(command, cancel)
+    if proc.returncode != 0:
+        raise CouldntDecodeError(proc.stderr.decode("utf-8", "ignore").strip())
+    frame_width = 2 * channels
+    first, end = gapless_bounds(track, len(proc.stdout) // frame_width, frame_rate)
+    data = proc.stdout[first * frame_width:end * frame_width]
+    return AudioSegment(data=data, sample_width=2, frame_rate=frame_rate, channels=channels)
+
+
+def safe_audio_segment(track, frame_rate=None, channels=None, trace=None, cancel=None):
+    start = time.perf_counter()
+    try:
+        audio = decode_track(track, frame_rate, channels, cancel)
+    except Exception as e:
+        if cancel is not None and cancel.is_set():
+            return None
+        print(f"Skipping {track.path}: {e}", file=sys.stderr)
+        if trace is not None:
+            trace.count("decode_failures")
+        return None
+    if trace is not None:
+        trace.track(track.path, "decode", time.perf_counter() - start)
+        trace.count("decoded_bytes", len(audio.raw_data))
+    return audio
+
+
+def decode_in_order(tracks, frame_rate, channels, max_in_flight=DECODE_THREADS, trace=None, cancel=None):
+    # Yields (track, segment) in the original track order while up to `max_in_flight`
+    # decodes run ahead. Failed tracks come back as None, like safe_audio_segment.
+    max_in_flight = max(1, max_in_flight)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        try:
+            for track in tracks:
+                pending.append((track, pool.submit(safe_audio_segment, track, frame_rate, channels, trace, cancel)))
+                if len(pending) >= max_in_flight:
+                    track, future = pending.popleft()
+                    yield track, future.result()
+            while pending:
+                track, future = pending.popleft()
+                yield track, future.result()
+        finally:
+            # Stopping early (cancel, encoder error) must not leave queued decodes running;
+            # running ones are killed through the cancel token.
+            for _, future in pending:
+                future.cancel()
+
+
+class SeamCrossfader:
+    # Blends the last `ms` of each track into the start of the next with linear ramps,
+    # on int16 numpy views of the PCM. The tail of the latest track is held back until
+    # the next one arrives (or flush() at the end of the album).
+    def __init__(self, frame_rate, channels, ms):
+        self.frames = max(1, int(frame_rate * ms / 1000))
+        self.channels = channels
+        self.tail = b""
+        self.fade_in = np.linspace(0.0, 1.0, self.frames, endpoint=False, dtype=np.float32)[:, None]
+        self.fade_out = 1.0 - self.fade_in
+
+    def process(self, data):
+        # Returns the buffers that are final and can be written out.
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        n = self.frames
+        if len(samples) < 2 * n:
+            return [self.flush(), data]
+        head = samples[:n]
+        if self.tail:
+            previous = np.frombuffer(self.tail, dtype=np.int16).reshape(-1, self.channels)
+            mixed = previous * self.fade_out + head * self.fade_in
+            head = np.clip(np.rint(mixed), -32768, 32767).astype(np.int16)
+        self.tail = samples[-n:].tobytes()
+        return [head.tobytes(), memoryview(samples[n:-n]).cast("B")]
+
+    def flush(self):
+        tail, self.tail = self.tail, b""
+        return tail
+
+
+def make_crossfader(frame_rate, channels, crossfade_ms):
+    if not crossfade_ms:
+        return None
+    if np is None:
+        print("numpy is not installed; joining tracks without a crossfade", file=sys.stderr)
+        return None
+    return SeamCrossfader(frame_rate, channels, crossfade_ms)
+
+
+def k_weighting_power(frame_rate, size):
+    # |H(f)|^2 of the BS.1770 K-weighting filter (high shelf, then high pass) at the bins of
+    # an rfft of `size` samples; the biquads are derived for this sample rate.
+    z = np.exp(-1j * np.pi * np.arange(size // 2 + 1) / (size / 2))
+    k = np.tan(np.pi * 1681.974450955533 / frame_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (((vh + vb * k / q + k * k) + 2 * (k * k - vh) * z + (vh - vb * k / q + k * k) * z * z)
+             / (a0 + 2 * (k * k - 1) * z + (1 - k / q + k * k) * z * z))
+    k = np.tan(np.pi * 38.13547087602444 / frame_rate)
+    q = 0.5003270373238773
+    high_pass = (1 - 2 * z + z * z) / ((1 + k / q + k * k) + 2 * (k * k - 1) * z + (1 - k / q + k * k) * z * z)
+    return np.abs(shelf * high_pass) ** 2
+
+
+def scale_pcm(samples, factor):
+    # int16 in, int16 out, rounded and clipped.
+    scaled = samples.astype(np.float32)
+    scaled *= factor
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, -32768, 32767, out=scaled)
+    return scaled.astype(np.int16)
+
+
+class LoudnessMeter:
+    # EBU R128 / BS.1770 integrated loudness of every track and of the album, measured on
+    # the decoded PCM. The K-weighting is applied in the frequency domain to 100 ms
+    # sub-blocks (all of a track's sub-blocks go through one batched rfft), and the
+    # 400 ms gating blocks with 75% overlap are sums of four sub-blocks.
+    SUB_BLOCK_MS = 100
+    BATCH = 600
+
+    def __init__(self, frame_rate, channels, mode):
+        self.mode = mode
+        self.channels = channels
+        self.step = frame_rate * self.SUB_BLOCK_MS // 1000
+        weights = np.full(self.step // 2 + 1, 2.0)
+        weights[0] = 1.0
+        if self.step % 2 == 0:
+            weights[-1] = 1.0
+        # Parseval: mean square of a block = sum of weighted |X_k|^2 / N^2
+        self.weights = (weights * k_weighting_power(frame_rate, self.step) / self.step ** 2)[:, None]
+        self.blocks = []
+        self.peak = 0.0
+        self.applied_gain_db = 0.0
+        self.seconds = 0.0
+
+    def gating_blocks(self, samples):
+        n = len(samples) // self.step * self.step
+        sub_blocks = samples[:n].reshape(-1, self.step, self.channels)
+        energy = []
+        for start in range(0, len(sub_blocks), self.BATCH):
+            spectrum = np.fft.rfft(sub_blocks[start:start + self.BATCH], axis=1)
+            energy.append(((spectrum.real ** 2 + spectrum.imag ** 2) * self.weights).sum(axis=1))
+        energy = np.concatenate(energy).sum(axis=1) if energy else np.zeros(0)
+        if len(energy) < 4:
+            return energy
+        running = np.concatenate(([0.0], np.cumsum(energy)))
+        return (running[4:] - running[:-4]) / 4
+
+    @staticmethod
+    def integrated(blocks):
+        # Absolute gate at -70 LUFS, then a relative gate 10 LU below the gated mean.
+        if not len(blocks):
+            return None
+        blocks = blocks[blocks > 10 ** ((-70 + 0.691) / 10)]
+        if not len(blocks):
+            return None
+        blocks = blocks[blocks > blocks.mean() * 10 ** (-10 / 10)]
+        return -0.691 + 10 * np.log10(blocks.mean())
+
+    def process(self, data):
+        # Measures one track; in "track" mode also returns it levelled to the target.
+        start = time.perf_counter()
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        blocks = self.gating_blocks(samples.astype(np.float32) / 32768)
+        peak = np.abs(samples).max() / 32768 if len(samples) else 0.0
+        loudness = self.integrated(blocks)
+        if self.mode == "track" and loudness is not None:
+            factor = self.gain_factor(LOUDNESS_TARGET_LUFS - loudness, peak)
+            data = scale_pcm(samples, factor).tobytes()
+            blocks = blocks * factor ** 2
+            peak *= factor
+        self.blocks.append(blocks)
+        self.peak = max(self.peak, peak)
+        self.seconds += time.perf_counter() - start
+        return data
+
+    @staticmethod
+    def gain_factor(gain_db, peak):
+        # Never boost a peak past full scale.
+        factor = 10 ** (gain_db / 20)
+        return min(factor, 1 / peak) if peak and factor > 1 else factor
+
+    def loudness(self):
+        return self.integrated(np.concatenate(self.blocks)) if self.blocks else None
+
+    def album_factor(self):
+        # Gain for "album" mode, applied to the assembled album by the caller.
+        loudness = self.loudness()
+        if self.mode != "album" or loudness is None:
+            return 1.0
+        factor = self.gain_factor(LOUDNESS_TARGET_LUFS - loudness, self.peak)
+        self.applied_gain_db = 20 * np.log10(factor)
+        return factor
+
+    def tags(self):
+        # The output file is one track and one album, so both tag pairs get the same values.
+        loudness = self.loudness()
+        if loudness is None:
+            return {}
+        gain_db = round(LOUDNESS_TARGET_LUFS - loudness - self.applied_gain_db, 2) + 0.0  # never "-0.00"
+        gain = f"{gain_db:+.2f} dB"
+        peak = f"{min(1.0, self.peak * 10 ** (self.applied_gain_db / 20)):.6f}"
+        return {"replaygain_track_gain": gain, "replaygain_track_peak": peak,
+                "replaygain_album_gain": gain, "replaygain_album_peak": peak}
+
+
+def make_loudness_meter(frame_rate, channels, mode):
+    if mode in (None, "off"):
+        return None
+    if np is None:
+        print("numpy is not installed; skipping loudness measurement", file=sys.stderr)
+        return None
+    return LoudnessMeter(frame_rate, channels, mode)
+
+
+class AlbumAssembler:
+    # Builds the album in one preallocated PCM buffer. `combined += audio` copies everything
+    # appended so far on every track, which is quadratic in album length.
+    CHUNK_SAMPLES = 1 << 22
+
+    def __init__(self, frame_rate, channels, sample_width=2, expected_ms=0, crossfade_ms=0):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_width = channels * sample_width
+        self.buffer = bytearray(self.ms_to_bytes(expected_ms))
+        self.length = 0
+        self.copy_seconds = 0.0
+        self.incremental_bytes = 0
+        self.crossfader = make_crossfader(frame_rate, channels, crossfade_ms)
+
+    def ms_to_bytes(self, ms):
+        return int(self.frame_rate * ms / 1000) * self.frame_width
+
+    def reserve(self, nbytes):
+        # The probed durations are only an estimate; grow if a track decodes longer.
+        end = self.length + nbytes
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(end - len(self.buffer)))
+        return end
+
+    def add(self, segment):
+        segment = (segment.set_frame_rate(self.frame_rate)
+                   .set_sample_width(self.sample_width)
+                   .set_channels(self.channels))
+        start = time.perf_counter()
+        chunks = self.crossfader.process(segment.raw_data) if self.crossfader else [segment.raw_data]
+        for data in chunks:
+            self.write(data)
+        self.copy_seconds += time.perf_counter() - start
+        self.incremental_bytes += self.length
+
+    def write(self, data):
+        end = self.reserve(len(data))
+        self.buffer[self.length:end] = data
+        self.length = end
+
+    def add_silence(self, duration_ms):
+        # Everything past self.length is still zero-filled, so a gap only moves the cursor.
+        self.length = self.reserve(self.ms_to_bytes(duration_ms))
+        self.incremental_bytes += self.length
+
+    def finish(self, gain_factor=1.0):
+        if self.crossfader:
+            self.write(self.crossfader.flush())
+        del self.buffer[self.length:]
+        if gain_factor != 1.0:
+            self.scale(gain_factor)
+        return AudioSegment(data=self.buffer, sample_width=self.sample_width,
+                            frame_rate=self.frame_rate, channels=self.channels)
+
+    def scale(self, factor):
+        # In place, a few MB at a time; the numpy view must be gone before the buffer resizes.
+        # Silent chunks (the gaps) are left alone so a sparse spool stays sparse.
+        samples = np.frombuffer(self.buffer, dtype=np.int16, count=self.length // self.sample_width)
+        for start in range(0, len(samples), self.CHUNK_SAMPLES):
+            chunk = samples[start:start + self.CHUNK_SAMPLES]
+            if chunk.any():
+                chunk[:] = scale_pcm(chunk, factor)
+
+    def time_saved(self):
+        # Repeated appends copy the running total each time; estimate that cost from the
+        # copy throughput measured here.
+        if not self.length or not self.copy_seconds:
+            return 0.0
+        return self.copy_seconds * (self.incremental_bytes / self.length - 1)
+
+
+class SpooledAssembler(AlbumAssembler):
+    # AlbumAssembler over a memory-mapped temporary file instead of a bytearray, for albums
+    # bigger than the memory budget. The file is sized up front with truncate(), so gaps
+    # stay sparse holes; the page cache, not this process, holds the PCM. finish() hands
+    # back the assembler itself, and the encoder reads straight from the mapping.
+    GROW_BYTES = 256 << 20
+
+    def __init__(self, frame_rate, channels, spool_dir, sample_width=2, expected_ms=0, crossfade_ms=0):
+        super().__init__(frame_rate, channels, sample_width, 0, crossfade_ms)
+        self.file = tempfile.TemporaryFile(prefix=".album_spool_", dir=spool_dir)
+        self.buffer = None
+        self.remap(max(self.ms_to_bytes(expected_ms), mmap.ALLOCATIONGRANULARITY))
+
+    def remap(self, size):
+        # Windows cannot resize a file while it is mapped, so unmap, grow, map again.
+        if self.buffer is not None:
+            self.buffer.close()
+        self.file.truncate(size)
+        self.buffer = mmap.mmap(self.file.fileno(), size)
+
+    def reserve(self, nbytes):
+        end = self.length + nbytes
+        if end > len(self.buffer):
+            self.remap(end + self.GROW_BYTES)
+        return end
+
+    def finish(self, gain_factor=1.0):
+        if self.crossfader:
+            self.write(self.crossfader.flush())
+        if gain_factor != 1.0:
+            self.scale(gain_factor)
+        return self
+
+    def duration_ms(self):
+        return self.length * 1000 // (self.frame_width * self.frame_rate)
+
+    def close(self):
+        # A slice of the mapping still referenced from an exception's frames makes
+        # mmap.close() raise BufferError; the mapping is then unmapped with its last view
+        # instead of hiding the real error. The temporary file goes either way.
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass
+        self.buffer = None
+        self.file.close()
+
+
+class StreamingEncoder:
+    # One long-running ffmpeg encoder fed with raw PCM through stdin.
+    CHUNK_BYTES = 1 << 20
+
+    def __init__(self, output_path, frame_rate, channels, bitrate, sample_width=2, on_progress=None,
+                 output_format=DEFAULT_FORMAT, cancel=None):
+        self.output_path = output_path
+        self.cancel = cancel
+        self.frame_rate = frame_rate
+        self.frame_width = channels * sample_width
+        self.on_progress = on_progress
+        self.bytes_written = 0
+        self.zero_chunk = bytes(self.CHUNK_BYTES)
+        # stderr goes to a file so a chatty encoder can never block on a full pipe
+        self.errors = tempfile.TemporaryFile()
+        command = [
+            AudioSegment.converter, "-v", "error", "-y",
+            "-f", f"s{8 * sample_width}le", "-ar", str(frame_rate), "-ac", str(channels), "-i", "-",
+        ] + encoder_args(output_format, bitrate) + [output_path]
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.errors)
+        if cancel is not None:
+            cancel.register(self.proc)
+
+    def feed(self, data):
+        try:
+            self.proc.stdin.write(data)
+        except BrokenPipeError:
+            # The encoder quit mid-album; its own message says why.
+            self.proc.wait()
+            self.errors.seek(0)
+            raise CouldntEncodeError(self.errors.read().decode("utf-8", "ignore").strip()
+                                     or f"encoder exited with code {self.proc.returncode}")
+        self.bytes_written += len(data)
+        if self.on_progress:
+            self.on_progress(self.bytes_written)
+
+    def write(self, data):
+        # Views are released even when the pipe breaks, so a spool's mapping can be closed.
+        with memoryview(data) as view:
+            for start in range(0, len(view), self.CHUNK_BYTES):
+                with view[start:start + self.CHUNK_BYTES] as chunk:
+                    self.feed(chunk)
+
+    def write_silence(self, duration_ms):
+        remaining = int(self.frame_rate * duration_ms / 1000) * self.frame_width
+        while remaining > 0:
+            chunk = min(remaining, self.CHUNK_BYTES)
+            self.feed(memoryview(self.zero_chunk)[:chunk])
+            remaining -= chunk
+
+    def duration_ms(self):
+        return self.bytes_written * 1000 // (self.frame_width * self.frame_rate)
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            if self.proc.wait() != 0:
+                self.errors.seek(0)
+                raise CouldntEncodeError(self.errors.read().decode("utf-8", "ignore").strip())
+        finally:
+            self.release()
+
+    def abort(self):
+        self.proc.kill()
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass  # the pipe is already broken when the encoder was killed mid-write
+        self.proc.wait()
+        self.release()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def release(self):
+        if self.cancel is not None:
+            self.cancel.unregister(self.proc)
+        self.errors.close()
+
+
+def encoder_args(output_format, bitrate):
+    fmt = OUTPUT_FORMATS[output_format]
+    args = ["-c:a", fmt.codec]
+    if fmt.kbps is None:
+        args += ["-b:a", bitrate]
+    return args + fmt.args + ["-f", fmt.container]
+
+
+def can_stream_copy(tracks):
+    first = tracks[0]
+    return all(t.codec == "mp3" and t.sample_rate == first.sample_rate and t.channels == first.channels
+               for t in tracks)
+
+
+def silent_mp3(duration_ms, frame_rate, channels, bitrate):
+    # Pre-encoded gap, generated once per layout and reused for every album that needs it.
+    path = os.path.join(tempfile.gettempdir(),
+                        f"album_combiner_silence_{duration_ms}ms_{frame_rate}_{channels}_{bitrate}.mp3")
+    if not os.path.exists(path):
+        partial = f"{path}.{os.getpid()}.part"
+        layout = "mono" if channels == 1 else "stereo"
+        command = [
+            AudioSegment.converter, "-v", "error", "-y",
+            "-f", "lavfi", "-i", f"anullsrc=r={frame_rate}:cl={layout}", "-t", f"{duration_ms / 1000}",
+            "-b:a", bitrate, "-write_xing", "0", "-id3v2_version", "0", "-f", "mp3", partial,
+        ]
+        proc = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise CouldntEncodeError(proc.stderr.decode("utf-8", "ignore").strip())
+        os.replace(partial, path)
+    return path
+
+
+def concat_list_line(path):
+    escaped = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def stream_copy_album(tracks, gap_ms, output_path, bitrate, on_progress=None, cancel=None):
+    # ffmpeg's concat demuxer copies the MP3 frames as they are; tags and the Xing header
+    # are rebuilt for the new file (source tags are dropped and written again by mutagen).
+    gap_path = silent_mp3(gap_ms, tracks[0].sample_rate, tracks[0].channels, bitrate) if gap_ms else None
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as listing:
+        for track in tracks:
+            listing.write(concat_list_line(track.path))
+            if gap_path:
+                listing.write(concat_list_line(gap_path))
+    errors = tempfile.TemporaryFile()
+    command = [
+        AudioSegment.converter, "-v", "error", "-y", "-nostats", "-progress", "pipe:1",
+        "-f", "concat", "-safe", "0", "-i", listing.name,
+        "-map", "0:a", "-c", "copy", "-map_metadata", "-1", "-f", "mp3", output_path,
+    ]
+    proc = None
+    try:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors, text=True)
+        if cancel is not None:
+            cancel.register(proc)
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_ms" and on_progress:
+                on_progress(to_number(value, int) // 1000)
+        returncode = proc.wait()
+        if cancel is not None and cancel.is_set():
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return False
+        if returncode != 0:
+            errors.seek(0)
+            raise CouldntEncodeError(errors.read().decode("utf-8", "ignore").strip())
+        return True
+    finally:
+        if cancel is not None and proc is not None:
+            cancel.unregister(proc)
+        errors.close()
+        os.remove(listing.name)
+
+
+def bitrate_kbps(bitrate):
+    return to_number(str(bitrate).rstrip("kK"), int)
+
+
+def estimate_output_size(tracks, bitrate, gap_ms=0, output_format=DEFAULT_FORMAT):
+    total_ms = sum(t.duration_ms for t in tracks) + gap_ms * len(tracks)
+    kbps = OUTPUT_FORMATS[output_format].kbps or bitrate_kbps(bitrate)
+    return total_ms * kbps // 8
+
+
+def build_output_path(output_dir, artist, album, in_artist_folder, output_format=DEFAULT_FORMAT):
+    extension = OUTPUT_FORMATS[output_format].extension
+    if in_artist_folder:
+        return os.path.join(output_dir, artist, f"{album}{extension}")
+    return os.path.join(output_dir, f"{artist} - {album}{extension}")
+
+
+def partial_output_path(output_path):
+    folder, name = os.path.split(output_path)
+    base, extension = os.path.splitext(name)
+    # The extension stays last so ffmpeg and mutagen still see the right format.
+    return os.path.join(folder, f".{base}.partial{extension}")
+
+
+def file_kind(name):
+    ext = os.path.splitext(name)[1].lower()
+    if ext in AUDIO_EXTENSIONS:
+        return "audio"
+    if ext in NON_AUDIO_EXTENSIONS:
+        return "other"
+    return "unknown"
+
+
+def restat_files(path, previous):
+    # Files edited in place (re-tagged, replaced by copying over) leave the folder's mtime
+    # alone, so an album folder's files are stat()ed again. None if one has disappeared.
+    files = []
+    changed = False
+    for name, kind, size, mtime in previous["files"]:
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except OSError:
+            return None, True
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            changed = True
+        files.append([name, kind, stat.st_size, stat.st_mtime_ns])
+    return dict(previous, files=files), changed
+
+
+def scan_directory(path, previous):
+    # One os.scandir pass per folder records names, kinds, sizes and mtimes. If the folder's
+    # own mtime matches the snapshot, no entry was added, removed or renamed, so the
+    # previous listing is reused; folders without audio are not even re-read, album folders
+    # only have their files stat()ed again.
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None, True
+    if previous is not None and previous["mtime"] == mtime:
+        if not any(f[1] != "other" for f in previous["files"]):
+            return previous, False
+        record, changed = restat_files(path, previous)
+        if record is not None:
+            return record, changed
+    record = {"mtime": mtime, "files": [], "dirs": []}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        record["dirs"].append(entry.name)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        record["files"].append([entry.name, file_kind(entry.name), stat.st_size, stat.st_mtime_ns])
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Could not read {path}: {e}", file=sys.stderr)
+    record["dirs"].sort()
+    record["files"].sort()
+    return record, True
+
+
+def join_rel(rel, name):
+    return name if rel == "." else f"{rel}/{name}"
+
+
+ScanResult = namedtuple("ScanResult", ["albums", "changed_dirs", "dir_count", "file_count", "seconds"])
+AlbumFingerprint = namedtuple("AlbumFingerprint", ["key", "album_path", "durations", "lossless", "sample_rate",
+                                                   "bit_rate", "audio_hash"])
+
+
+class LibraryScanner:
+    # Walks a library with parallel os.scandir calls and keeps a snapshot per root folder,
+    # so a rescan only lists the folders that changed. Any folder holding audio files is an
+    # album (disc folders are folded into their parent), however deep it is nested.
+    def __init__(self, workers=SCAN_THREADS, snapshot_dir=None):
+        self.workers = workers
+        self.snapshot_dir = snapshot_dir or os.path.join(app_data_dir(), "scans")
+
+    def snapshot_path(self, root):
+        digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()
+        return os.path.join(self.snapshot_dir, f"{digest}.json")
+
+    def load_snapshot(self, root):
+        try:
+            with open(self.snapshot_path(root), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_snapshot(self, root, records):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = self.snapshot_path(root)
+        with open(f"{path}.part", "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        os.replace(f"{path}.part", path)
+
+    def walk(self, root, previous):
+        records = {}
+        changed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(scan_directory, root, previous.get(".")): "."}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel = pending.pop(future)
+                    record, was_changed = future.result()
+                    if record is None:
+                        continue
+                    records[rel] = record
+                    if was_changed:
+                        changed.append(rel)
+                    for name in record["dirs"]:
+                        child = join_rel(rel, name)
+                        pending[pool.submit(scan_directory, os.path.join(root, *child.split("/")),
+                                            previous.get(child))] = child
+        changed += [rel for rel in previous if rel not in records]  # removed folders
+        return records, sorted(changed)
+
+    def find_albums(self, root, records):
+        def has_audio(rel):
+            return any(f[1] == "audio" for f in records.get(rel, {}).get("files", []))
+
+        root_name = os.path.basename(os.path.abspath(root))
+        albums = []
+        seen = set()
+        for rel in sorted(records):
+            name = root_name if rel == "." else rel.rsplit("/", 1)[-1]
+            if rel != "." and disc_number(name) is not None:
+                continue
+            discs = [join_rel(rel, d) for d in records[rel]["dirs"] if disc_number(d) is not None]
+            if not has_audio(rel) and not any(has_audio(d) for d in discs):
+                continue
+            if rel == ".":
+                artist = os.path.basename(os.path.dirname(os.path.abspath(root)))
+            elif "/" in rel:
+                artist = rel.rsplit("/", 2)[-2]
+            else:
+                artist = root_name
+            album = name
+            suffix = 2
+            while (artist, album) in seen:
+                album = f"{name} ({suffix})"
+                suffix += 1
+            seen.add((artist, album))
+            albums.append((artist, album, os.path.join(root, *rel.split("/")) if rel != "." else root))
+        return albums
+
+    def scan(self, root, use_snapshot=True):
+        start = time.perf_counter()
+        previous = self.load_snapshot(root) if use_snapshot else {}
+        records, changed = self.walk(root, previous)
+        self.save_snapshot(root, records)
+        file_count = sum(len(r["files"]) for r in records.values())
+        return ScanResult(self.find_albums(root, records), changed, len(records), file_count,
+                          time.perf_counter() - start)
+
+
+def quick_track_info(file_path):
+    # (seconds, lossless, sample rate, bit rate) from the file headers. mutagen reads them
+    # without launching anything; ffprobe is only asked about files mutagen cannot parse.
+    if not looks_like_audio(file_path):
+        return None
+    try:
+        audio = mutagen.File(file_path)
+    except Exception:
+        audio = None
+    if audio is not None and getattr(audio.info, "length", 0) > 0:
+        info = audio.info
+        lossless = type(audio).__name__ in LOSSLESS_TYPES or getattr(info, "codec", "") == "alac"
+        return (info.length, lossless, getattr(info, "sample_rate", 0) or 0, getattr(info, "bitrate", 0) or 0)
+    track = probe_track(file_path)
+    if track is None:
+        return None
+    lossless = track.codec in LOSSLESS_CODECS or track.codec.startswith("pcm_")
+    return track.duration_ms / 1000, lossless, track.sample_rate, track.bit_rate
+
+
+def quick_audio_hash(file_path, start_seconds):
+    # One bit per block: did the energy rise from the previous block? The contour survives
+    # lossy encoding and resampling, unlike a hash of the bytes. Returned as a "0101..."
+    # string; None if the file could not be decoded.
+    command = [
+        AudioSegment.converter, "-v", "error", "-ss", f"{start_seconds:.3f}", "-t", str(QUICK_HASH_SECONDS),
+        "-i", file_path, "-vn", "-ac", "1", "-ar", str(QUICK_HASH_RATE), "-f", "s16le", "-",
+    ]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return None
+    samples = array("h")
+    samples.frombytes(proc.stdout[:len(proc.stdout) // 2 * 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    block = QUICK_HASH_RATE * QUICK_HASH_BLOCK_MS // 1000
+    energies = [sum(x * x for x in samples[i:i + block]) for i in range(0, len(samples) - block + 1, block)]
+    return "".join("1" if b > a else "0" for a, b in zip(energies, energies[1:]))
+
+
+def fingerprint_album(key, album_path, quick_hash=False):
+    infos = []
+    paths = []
+    for entry in list_album_files(album_path):
+        info = quick_track_info(entry.path)
+        if info is not None:
+            infos.append(info)
+            paths.append(entry.path)
+    if not infos:
+        return None
+    audio_hash = None
+    if quick_hash:
+        audio_hash = quick_audio_hash(paths[0], QUICK_HASH_OFFSET_SECONDS)
+    return AlbumFingerprint(
+        key=key,
+        album_path=album_path,
+        durations=[round(info[0], 1) for info in infos],
+        lossless=all(info[1] for info in infos),
+        sample_rate=min(info[2] for info in infos),
+        bit_rate=sum(info[3] for info in infos) // len(infos),
+        audio_hash=audio_hash,
+    )
+
+
+def fingerprint_quality(fingerprint):
+    # Lossless beats lossy, then the higher sample rate, then (for lossy copies) the
+    # higher bit rate; lossless bit rates only say how well the encoder compressed.
+    return (fingerprint.lossless, fingerprint.sample_rate, 0 if fingerprint.lossless else fingerprint.bit_rate)
+
+
+def same_recording(a, b):
+    if len(a.durations) != len(b.durations):
+        return False
+    if any(abs(x - y) > DUPLICATE_TOLERANCE_SECONDS for x, y in zip(a.durations, b.durations)):
+        return False
+    bits = min(len(a.audio_hash or ""), len(b.audio_hash or ""))
+    if not bits:
+        return len(a.durations) >= DUPLICATE_MIN_TRACKS
+    differing = sum(x != y for x, y in zip(a.audio_hash[:bits], b.audio_hash[:bits]))
+    return differing <= bits * QUICK_HASH_MAX_DIFFERENCE
+
+
+def group_duplicates(fingerprints):
+    # Groups of two or more likely copies of one album, best copy first. Every copy is
+    # matched against the group's best copy, never against another copy, so small length
+    # differences cannot chain distinct albums together. Only albums with the same track
+    # count and a total length within reach of the best copy are compared.
+    by_count = {}
+    for fp in fingerprints:
+        by_count.setdefault(len(fp.durations), []).append(fp)
+    groups = []
+    for count, candidates in by_count.items():
+        candidates.sort(key=lambda fp: sum(fp.durations))
+        totals = [sum(fp.durations) for fp in candidates]
+        window = DUPLICATE_TOLERANCE_SECONDS * count
+        grouped = set()
+        for best in sorted(candidates, key=fingerprint_quality, reverse=True):
+            if best.key in grouped:
+                continue
+            grouped.add(best.key)
+            total = sum(best.durations)
+            nearby = candidates[bisect.bisect_left(totals, total - window):bisect.bisect_right(totals, total + window)]
+            copies = [fp for fp in nearby if fp.key not in grouped and same_recording(best, fp)]
+            if copies:
+                grouped.update(fp.key for fp in copies)
+                groups.append([best] + sorted(copies, key=fingerprint_quality, reverse=True))
+    return groups
+
+
+def find_duplicates(albums, quick_hash=False, workers=FINGERPRINT_THREADS):
+    # `albums` are (artist, album, album_path) as found by LibraryScanner. Returns the
+    # duplicate groups (lists of AlbumFingerprint, best first) and the seconds it took.
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        fingerprints = list(pool.map(lambda a: fingerprint_album((a[0], a[1]), a[2], quick_hash), albums))
+    groups = group_duplicates([fp for fp in fingerprints if fp is not None])
+    return groups, time.perf_counter() - start
+
+
+def make_job(artist, album, album_path, output_dir, bitrate, mode="memory", gap_ms=GAP_DURATION_MS,
+             in_artist_folder=False, decode_threads=DECODE_THREADS, trace_dir=None, profile=False,
+             output_format=DEFAULT_FORMAT, crossfade_ms=0, loudness="off", memory_budget_mb=MEMORY_BUDGET_MB,
+             artwork=True, cover_path=None):
+    # cover_path is a fallback cover (the GUI's cached remote art) that may only appear
+    # while the album converts; a cover in the album folder always wins.
+    return {
+        "key": (artist, album),
+        "artist": artist,
+        "album": album,
+        "album_path": album_path,
+        "output_dir": output_dir,
+        "output_path": build_output_path(output_dir, artist, album, in_artist_folder, output_format),
+        "format": output_format,
+        "crossfade_ms": crossfade_ms,
+        "loudness": loudness,
+        "bitrate": bitrate,
+        "mode": mode,
+        "gap_ms": gap_ms,
+        "decode_threads": decode_threads,
+        "memory_budget_mb": memory_budget_mb,
+        "artwork": artwork,
+        "cover_path": cover_path,
+        "trace_dir": trace_dir,
+        "profile": profile,
+    }
+
+
+def album_result(artist, album, success=False, duration="", size_mb=None, **extra):
+    return dict(artist=artist, album=album, success=success, duration=duration, size_mb=size_mb, **extra)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def album_signature(job, with_hashes=False):
+    # Everything that decides the content of the output file. Sizes and mtimes come from the
+    # directory scan itself; hashing is optional because it reads every byte of the album.
+    files = []
+    for entry in list_album_files(job["album_path"]):
+        if os.path.splitext(entry.name)[1].lower() in NON_AUDIO_EXTENSIONS:
+            continue
+        stat = entry.stat()
+        name = os.path.relpath(entry.path, job["album_path"]).replace(os.sep, "/")
+        record = [name, stat.st_size, stat.st_mtime_ns]
+        if with_hashes:
+            record.append(file_digest(entry.path))
+        files.append(record)
+    signature = {"files": files, "bitrate": job["bitrate"], "gap_ms": job["gap_ms"], "mode": job["mode"]}
+    # Left out for plain MP3 without crossfades or loudness so manifests written before formats existed stay valid.
+    if job.get("format", DEFAULT_FORMAT) != DEFAULT_FORMAT:
+        signature["format"] = job["format"]
+    if seam_crossfade_ms(job):
+        signature["crossfade_ms"] = job["crossfade_ms"]
+    if job.get("loudness", "off") != "off":
+        signature["loudness"] = job["loudness"]
+    # Cover images are not in "files"; the one that would be embedded is recorded on its own.
+    if not job.get("artwork", True):
+        signature["artwork"] = False
+    else:
+        cover = choose_cover(job)
+        if cover is not None:
+            signature["cover"] = cover_record(job, cover)
+    return signature
+
+
+class AlbumManifest:
+    def __init__(self, output_dir, with_hashes=False):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.with_hashes = with_hashes
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def entry_key(self, job):
+        return os.path.relpath(job["output_path"], self.output_dir).replace(os.sep, "/")
+
+    def check(self, job):
+        # Returns (up_to_date, signature, previously_built).
+        signature = album_signature(job, self.with_hashes)
+        previous = self.entries.get(self.entry_key(job))
+        if previous and not self.with_hashes:
+            # A manifest written with hashes still matches on size/mtime alone.
+            previous = dict(previous, files=[f[:3] for f in previous["files"]])
+        up_to_date = previous == signature and os.path.exists(job["output_path"])
+        return up_to_date, signature, previous is not None
+
+    def record(self, job, signature):
+        self.entries[self.entry_key(job)] = signature
+        self.save()
+
+    def forget(self, job):
+        if self.entries.pop(self.entry_key(job), None) is not None:
+            self.save()
+
+    def save(self):
+        partial = f"{self.path}.part"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(partial, self.path)
+
+
+class JobJournal:
+    # The current batch on disk, so it can be picked up again after a crash, a reboot or
+    # closing the app. Every album goes queued -> running -> done/failed/cancelled, with
+    # the job dict it runs with; albums that never finished are offered again.
+    RESUMABLE = ("queued", "running", "cancelled")
+
+    def __init__(self, name, directory=None):
+        self.path = os.path.join(directory or app_data_dir(), f"journal-{name}.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def entry_key(job):
+        return job["output_path"]
+
+    def begin(self, jobs):
+        with self.lock:
+            self.entries = {self.entry_key(job): {"status": "queued", "job": job} for job in jobs}
+            self.save()
+
+    def mark(self, job, status):
+        with self.lock:
+            self.entries[self.entry_key(job)] = {"status": status, "job": job}
+            self.save()
+
+    def drop(self, job):
+        with self.lock:
+            if self.entries.pop(self.entry_key(job), None) is not None:
+                self.save()
+
+    def unfinished(self):
+        jobs = []
+        for entry in self.entries.values():
+            if entry["status"] in self.RESUMABLE:
+                job = dict(entry["job"])
+                job["key"] = tuple(job["key"])
+                jobs.append(job)
+        return jobs
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def save(self):
+        partial = f"{self.path}.part"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(partial, self.path)
+
+
+def format_duration(duration_ms):
+    minutes = duration_ms // 60000
+    seconds = (duration_ms % 60000) // 1000
+    return f"{minutes}:{seconds:02}"
+
+
+def assemble_in_memory(tracks, gap_ms, on_progress, cancel, decode_threads=DECODE_THREADS, trace=None,
+                       crossfade_ms=0, meter=None, spool_dir=None):
+    # Decode/assemble half of memory mode; the encode is a separate pipeline stage. With a
+    # spool_dir the album is assembled in a SpooledAssembler there, which is returned
+    # instead of an AudioSegment.
+    total_ms = sum(t.duration_ms for t in tracks)
+    on_progress(0, total_ms)
+    frame_rate, channels = album_layout(tracks)
+    expected_ms = sum(t.duration_ms + gap_ms for t in tracks)
+    if spool_dir is None:
+        assembler = AlbumAssembler(frame_rate, channels, expected_ms=expected_ms, crossfade_ms=crossfade_ms)
+    else:
+        assembler = SpooledAssembler(frame_rate, channels, spool_dir, expected_ms=expected_ms,
+                                     crossfade_ms=crossfade_ms)
+    done_ms = 0
+
+    for track, audio in decode_in_order(tracks, frame_rate, channels, decode_threads, trace, cancel):
+        if cancel.is_set():
+            if spool_dir is not None:
+                assembler.close()
+            return None
+        if audio:
+            if meter:
+                audio = AudioSegment(data=meter.process(audio.raw_data), sample_width=2,
+                                     frame_rate=frame_rate, channels=channels)
+            assembler.add(audio)
+            del audio
+            if gap_ms:
+                assembler.add_silence(gap_ms)
+        done_ms += track.duration_ms
+        on_progress(done_ms, total_ms)
+
+    combined = assembler.finish(meter.album_factor() if meter else 1.0)
+    if trace is not None:
+        trace.add("assemble", assembler.copy_seconds)
+    where = "spooled to disk" if spool_dir is not None else "in memory"
+    print(f"Assembled {len(tracks)} tracks: {assembler.length / (1024 * 1024):.0f} MB PCM {where}, "
+          f"~{assembler.time_saved():.1f}s saved over incremental appends", file=sys.stderr)
+    return combined
+
+
+def encode_pcm(data, length, frame_rate, channels, output_path, bitrate, output_format, on_progress, cancel):
+    # Pipes assembled PCM (an AudioSegment's bytes or a spool's mapping) to one ffmpeg
+    # encoder a slice at a time, without copying it; cancelling kills the encoder.
+    encoder = StreamingEncoder(output_path, frame_rate, channels, bitrate,
+                               on_progress=lambda done: on_progress(done, length),
+                               output_format=output_format, cancel=cancel)
+    step = 16 * StreamingEncoder.CHUNK_BYTES
+    try:
+        with memoryview(data) as view:
+            for start in range(0, length, step):
+                if cancel.is_set():
+                    encoder.abort()
+                    return None
+                with view[start:min(start + step, length)] as chunk:
+                    encoder.write(chunk)
+        encoder.close()
+    except Exception:
+        encoder.abort()
+        if cancel.is_set():
+            return None
+        raise
+    return encoder.duration_ms()
+
+
+def discard_audio(state):
+    audio = state.pop("audio", None)
+    if isinstance(audio, SpooledAssembler):
+        audio.close()
+
+
+def render_streaming(tracks, gap_ms, output_path, bitrate, on_progress, cancel,
+                     decode_threads=DECODE_THREADS, trace=None, output_format=DEFAULT_FORMAT, crossfade_ms=0,
+                     meter=None):
+    # The album is encoded as it is decoded, so an album gain can only be written as tags.
+    frame_rate, channels = album_layout(tracks)
+    expected_ms = sum(t.duration_ms + gap_ms for t in tracks)
+    total_bytes = int(frame_rate * expected_ms / 1000) * channels * 2
+    on_progress(0, total_bytes)
+    encoder = StreamingEncoder(output_path, frame_rate, channels, bitrate,
+                               on_progress=lambda done: on_progress(done, total_bytes),
+                               output_format=output_format, cancel=cancel)
+    crossfader = make_crossfader(frame_rate, channels, crossfade_ms)
+    try:
+        for track, audio in decode_in_order(tracks, frame_rate, channels, decode_threads, trace, cancel):
+            if cancel.is_set():
+                encoder.abort()
+                return None
+            if audio:
+                data = meter.process(audio.raw_data) if meter else audio.raw_data
+                for chunk in crossfader.process(data) if crossfader else [data]:
+                    encoder.write(chunk)
+                del audio
+                if gap_ms:
+                    encoder.write_silence(gap_ms)
+        if crossfader:
+            encoder.write(crossfader.flush())
+        encoder.close()
+    except Exception:
+        encoder.abort()
+        if cancel.is_set():
+            return None  # the encoder was killed mid-write
+        raise
+    return encoder.duration_ms()
+
+
+def render_copy(tracks, gap_ms, output_path, bitrate, on_progress, cancel,
+                decode_threads=DECODE_THREADS, trace=None, output_format=DEFAULT_FORMAT, crossfade_ms=0,
+                meter=None):
+    # Frames are copied untouched, so there is nothing to trim, crossfade or measure here.
+    total_ms = sum(t.duration_ms + gap_ms for t in tracks)
+    on_progress(0, total_ms)
+    copied = stream_copy_album(tracks, gap_ms, output_path, bitrate,
+                               on_progress=lambda done: on_progress(done, total_ms),
+                               cancel=cancel)
+    if not copied:
+        return None
+    return int(mutagen.File(output_path).info.length * 1000)
+
+
+# Modes that decode and encode in one pass. Memory mode is split across the decode and
+# encode stages instead, see decode_album/encode_album.
+RENDERERS = {"stream": render_streaming, "copy": render_copy}
+
+
+def find_local_cover(album_path):
+    images = [e for e in list_album_files(album_path) if os.path.splitext(e.name)[1].lower() in COVER_TYPES]
+
+    def rank(entry):
+        # Exact names ("cover.jpg") first, then a name followed by a separator
+        # ("cover (front).jpg", "folder_500.png"); "covers.jpg" or "albumartsmall" do not count.
+        stem = os.path.splitext(entry.name)[0].lower()
+        for tier, matches in ((0, lambda name: stem == name),
+                              (1, lambda name: re.match(rf"{name}[\W_]", stem))):
+            for i, name in enumerate(COVER_NAMES):
+                if matches(name):
+                    return tier, i
+        return None
+
+    named = sorted((rank(e), i, e.path) for i, e in enumerate(images) if rank(e) is not None)
+    if named:
+        return named[0][2]
+    return images[0].path if len(images) == 1 else None
+
+
+def load_cover(path):
+    # (mime, data) ready to embed, or None. Small files go in as they are; big ones are
+    # decoded and scaled by ffmpeg (fast bilinear) so PIL stays out of the engine.
+    mime = COVER_TYPES.get(os.path.splitext(path)[1].lower(), "image/jpeg")
+    if os.path.getsize(path) <= COVER_MAX_BYTES:
+        with open(path, "rb") as f:
+            return mime, f.read()
+    box = COVER_MAX_PIXELS
+    command = [
+        AudioSegment.converter, "-v", "error", "-i", path, "-frames:v", "1",
+        "-vf", f"scale='min({box},iw)':'min({box},ih)':force_original_aspect_ratio=decrease:flags=fast_bilinear",
+        "-q:v", "3", "-c:v", "mjpeg", "-f", "image2pipe", "-",
+    ]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0 or not proc.stdout:
+        print(f"Could not scale {path}: {proc.stderr.decode('utf-8', 'ignore').strip()}", file=sys.stderr)
+        return None
+    return "image/jpeg", proc.stdout
+
+
+def cover_picture(mime, data):
+    picture = Picture()
+    picture.type = 3  # front cover
+    picture.mime = mime
+    picture.desc = "Cover"
+    picture.data = data
+    return picture
+
+
+def embed_cover(output_path, mime, data):
+    # The front cover in whatever form the container expects: an ID3 APIC frame, a FLAC
+    # PICTURE block, an MP4 covr atom, or a base64 METADATA_BLOCK_PICTURE comment in Ogg.
+    audio = mutagen.File(output_path)
+    if audio is None:
+        raise ValueError(f"Cannot embed artwork in {output_path}: unrecognised format")
+    if isinstance(audio, FLAC):
+        audio.clear_pictures()
+        audio.add_picture(cover_picture(mime, data))
+    elif isinstance(audio, MP4):
+        image_format = MP4Cover.FORMAT_PNG if mime == "image/png" else MP4Cover.FORMAT_JPEG
+        audio.tags["covr"] = [MP4Cover(data, imageformat=image_format)]
+    elif isinstance(audio.tags, ID3):
+        audio.tags.delall("APIC")
+        audio.tags.add(APIC(encoding=3, mime=mime, type=3, desc="Cover", data=data))
+    else:
+        audio["metadata_block_picture"] = [base64.b64encode(cover_picture(mime, data).write()).decode("ascii")]
+    audio.save()
+
+
+def tag_output(output_path, artist, album, extra_tags=None, cover=None):
+    # mutagen's "easy" interface maps these keys to ID3 frames, Vorbis comments or MP4
+    # atoms depending on the file, so every output format is tagged the same way.
+    audio = mutagen.File(output_path, easy=True)
+    if audio is None:
+        raise ValueError(f"Cannot tag {output_path}: unrecognised format")
+    if audio.tags is None:
+        audio.add_tags()
+    audio["artist"] = artist
+    audio["album"] = album
+    audio["title"] = f"{album} (Full Album)"
+    for key, value in (extra_tags or {}).items():
+        audio[key] = value
+    audio.save()
+    if cover is not None:
+        try:
+            embed_cover(output_path, *cover)
+        except (mutagen.MutagenError, ValueError) as e:
+            print(f"Could not embed artwork in {output_path}: {e}", file=sys.stderr)
+
+
+class AlbumTrace:
+    # Timers and counters for one album: wall time per stage, probe/decode time per track
+    # and a few counters. Kept to plain dicts so it travels back from worker processes
+    # inside the result, and so a batch total is just the sum of its albums. Tracks are
+    # decoded on several threads at once, so updates take a lock.
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.tracks = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def track(self, path, stage, seconds):
+        with self.lock:
+            self.tracks.setdefault(path, {})[stage] = round(seconds, 4)
+        self.add(f"track_{stage}", seconds)
+        self.count(f"{stage}s")
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def merge(self, data):
+        for stage, seconds in data["stages"].items():
+            self.add(stage, seconds)
+        for name, n in data["counters"].items():
+            self.count(name, n)
+
+    def as_dict(self, with_tracks=True):
+        with self.lock:
+            data = {
+                "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+            if with_tracks:
+                data["tracks"] = [dict(file=path, **times) for path, times in self.tracks.items()]
+        return data
+
+
+def trace_file_name(job, extension):
+    return re.sub(r'[\\/:*?"<>|]', "_", f"{job['artist']} - {job['album']}") + extension
+
+
+# A conversion is four stages, each taking and updating the album's state dict:
+# scan (probe tracks) -> decode (assemble PCM) -> encode -> tag. Once a stage sets
+# state["result"] the later ones pass the album through untouched.
+
+def new_album_state(job, report, cancel):
+    return {"job": job, "report": report, "cancel": cancel, "result": None,
+            "trace": AlbumTrace()}
+
+
+def prepare_album(state):
+    job, report = state["job"], state["report"]
+    report("status", "Processing Audio")
+    tracks = scan_album_tracks(job["album_path"], state["trace"])
+    if not tracks:
+        state["result"] = album_result(job["artist"], job["album"])
+        return
+    output_format = job.get("format", DEFAULT_FORMAT)
+    estimate_mb = estimate_output_size(tracks, job["bitrate"], job["gap_ms"], output_format) / (1024 * 1024)
+    report("status", f"Processing Audio (~{estimate_mb:.0f} MB)")
+    mode = job["mode"]
+    if mode == "copy" and job.get("loudness", "off") != "off":
+        print(f"{job['artist']} - {job['album']}: measuring loudness needs decoded audio, transcoding instead "
+              f"of copying", file=sys.stderr)
+        mode = "memory"
+    elif mode == "copy" and OUTPUT_FORMATS[output_format].container != "mp3":
+        print(f"{job['artist']} - {job['album']}: copying only makes MP3s, encoding {output_format} instead",
+              file=sys.stderr)
+        mode = "memory"
+    elif mode == "copy" and not can_stream_copy(tracks):
+        print(f"{job['artist']} - {job['album']}: mixed formats, transcoding instead of copying", file=sys.stderr)
+        mode = "memory"
+    state["tracks"] = tracks
+    state["mode"] = mode
+    if mode != "copy":
+        state["meter"] = make_loudness_meter(*album_layout(tracks), job.get("loudness", "off"))
+        if state["meter"] and state["meter"].mode == "album" and mode == "stream":
+            print(f"{job['artist']} - {job['album']}: stream mode writes the album gain as tags only", file=sys.stderr)
+
+
+def seam_crossfade_ms(job):
+    # Crossfades smooth gapless joins; with a silent gap between tracks there is no seam.
+    return 0 if job["gap_ms"] else job.get("crossfade_ms", 0)
+
+
+def decode_album(state):
+    # Only memory mode has a separate decode; stream and copy decode while they encode.
+    if state["mode"] != "memory":
+        return
+    job, report = state["job"], state["report"]
+    tracks = state["tracks"]
+    frame_rate, channels = album_layout(tracks)
+    pcm_mb = frame_rate * channels * 2 * sum(t.duration_ms + job["gap_ms"] for t in tracks) / 1000 / (1024 * 1024)
+    spool_dir = None
+    if pcm_mb > job.get("memory_budget_mb", MEMORY_BUDGET_MB):
+        spool_dir = os.path.dirname(job["output_path"])
+        os.makedirs(spool_dir, exist_ok=True)
+        report("status", f"Processing Audio (spooling {pcm_mb:.0f} MB to disk)")
+    audio = assemble_in_memory(tracks, job["gap_ms"],
+                               on_progress=lambda done, total: report("progress", done, total),
+                               cancel=state["cancel"],
+                               decode_threads=job.get("decode_threads", DECODE_THREADS),
+                               trace=state["trace"], crossfade_ms=seam_crossfade_ms(job), meter=state["meter"],
+                               spool_dir=spool_dir)
+    if audio is None:
+        state["result"] = album_result(job["artist"], job["album"])
+        return
+    state["audio"] = audio
+
+
+def encode_album(state):
+    # Encodes to a hidden partial file next to the output; tag_album renames it into place,
+    # so an interrupted run never leaves a truncated file under the final name.
+    job, report = state["job"], state["report"]
+    os.makedirs(os.path.dirname(job["output_path"]), exist_ok=True)
+    output_path = state["work_path"] = partial_output_path(job["output_path"])
+    if state["mode"] == "memory":
+        if state["cancel"].is_set():
+            duration = None
+        else:
+            # A killable ffmpeg encoder fed from the assembled PCM, rather than
+            # AudioSegment.export, which cannot be interrupted and writes a temp WAV first.
+            report("status", "Encoding")
+            audio = state["audio"]
+            if isinstance(audio, SpooledAssembler):
+                pcm = (audio.buffer, audio.length, audio.frame_rate, audio.channels)
+            else:
+                pcm = (audio.raw_data, len(audio.raw_data), audio.frame_rate, audio.channels)
+            try:
+                duration = encode_pcm(*pcm, output_path, job["bitrate"], job.get("format", DEFAULT_FORMAT),
+                                      on_progress=lambda done, total: report("progress", done, total),
+                                      cancel=state["cancel"])
+            finally:
+                del pcm
+                discard_audio(state)
+    else:
+        duration = RENDERERS[state["mode"]](state["tracks"], job["gap_ms"], output_path, job["bitrate"],
+                                            on_progress=lambda done, total: report("progress", done, total),
+                                            cancel=state["cancel"],
+                                            decode_threads=job.get("decode_threads", DECODE_THREADS),
+                                            trace=state["trace"],
+                                            output_format=job.get("format", DEFAULT_FORMAT),
+                                            crossfade_ms=seam_crossfade_ms(job), meter=state.get("meter"))
+    if duration is None:
+        state["result"] = album_result(job["artist"], job["album"])
+        return
+    state["duration"] = duration
+
+
+def choose_cover(job):
+    path = find_local_cover(job["album_path"])
+    if path is None and job.get("cover_path") and os.path.isfile(job["cover_path"]):
+        path = job["cover_path"]
+    return path
+
+
+def cover_record(job, path):
+    # The GUI's cached remote cover is rewritten (new mtime, same picture) whenever its
+    # cache entry expires and is looked up again, so it is recorded by content instead.
+    if path == job.get("cover_path"):
+        return ["remote", file_digest(path)]
+    stat = os.stat(path)
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+
+def artwork_album(state):
+    # After the encode, so a remote cover looked up while the album converted is ready.
+    job = state["job"]
+    if not job.get("artwork", True):
+        return
+    path = choose_cover(job)
+    if path is None:
+        return
+    try:
+        state["cover_record"] = cover_record(job, path)
+        state["cover"] = load_cover(path)
+    except OSError as e:
+        state.pop("cover_record", None)
+        print(f"Skipping artwork {path}: {e}", file=sys.stderr)
+
+
+def tag_album(state):
+    job = state["job"]
+    work_path = state["work_path"]
+    meter = state.get("meter")
+    if meter:
+        state["trace"].add("loudness", meter.seconds)
+        loudness = meter.loudness()
+        if loudness is not None:
+            print(f"{job['artist']} - {job['album']}: {loudness:.1f} LUFS, {meter.applied_gain_db:+.1f} dB applied",
+                  file=sys.stderr)
+    tag_output(work_path, job["artist"], job["album"], meter.tags() if meter else None, state.get("cover"))
+    size_mb = os.path.getsize(work_path) / (1024 * 1024)
+    os.replace(work_path, job["output_path"])
+    # Seconds of audio encoded per second; in stream and copy modes this includes decoding.
+    encode_seconds = state["trace"].stages.get("encode", 0.0)
+    speed = state["duration"] / 1000 / encode_seconds if encode_seconds else None
+    state["result"] = album_result(job["artist"], job["album"], True, format_duration(state["duration"]), size_mb,
+                                   format=job.get("format", DEFAULT_FORMAT), encode_speed=speed,
+                                   cover=state.get("cover_record"))
+
+
+ALBUM_STAGES = [("scan", prepare_album), ("decode", decode_album), ("encode", encode_album), ("art", artwork_album),
+                ("tag", tag_album)]
+
+
+def run_stage(name, stage, state):
+    if state["result"] is not None:
+        return
+    try:
+        with state["trace"].timed(name):
+            stage(state)
+    except Exception as e:
+        if not state["cancel"].is_set():
+            print(f"Export failed: {e}", file=sys.stderr)
+        discard_audio(state)
+        state["result"] = album_result(state["job"]["artist"], state["job"]["album"])
+
+
+def album_outcome(state, profiler=None):
+    # The result with its trace attached; with a trace_dir the trace (and the cProfile
+    # stats, if profiling) is also written there, one file per album.
+    job, trace = state["job"], state["trace"]
+    result = dict(state["result"], trace=trace.as_dict(with_tracks=False))
+    discard_audio(state)
+    work_path = state.get("work_path")
+    if not result["success"] and work_path and os.path.exists(work_path):
+        try:
+            os.remove(work_path)
+        except OSError as e:
+            print(f"Could not remove {work_path}: {e}", file=sys.stderr)
+    trace_dir = job.get("trace_dir")
+    if trace_dir:
+        try:
+            os.makedirs(trace_dir, exist_ok=True)
+            with open(os.path.join(trace_dir, trace_file_name(job, ".json")), "w", encoding="utf-8") as f:
+                json.dump(dict(trace.as_dict(), artist=job["artist"], album=job["album"],
+                               mode=state.get("mode", job["mode"]), success=result["success"]), f, indent=1)
+            if profiler is not None:
+                profiler.dump_stats(os.path.join(trace_dir, trace_file_name(job, ".prof")))
+        except OSError as e:
+            print(f"Could not write trace for {job['artist']} - {job['album']}: {e}", file=sys.stderr)
+    return result
+
+
+def convert_album_job(job, events=None, cancel_event=None):
+    # Runs in a worker process: everything it needs is in `job`, and progress/status go
+    # back to the GUI through `events` as (key, kind, *values) tuples.
+    key = job["key"]
+
+    def report(kind, *values):
+        if events is not None:
+            events.put((key, kind) + values)
+
+    cancel = CancelToken(cancel_event)
+    state = new_album_state(job, report, cancel)
+    profiler = cProfile.Profile() if job.get("profile") else None
+    with cancel.watch():
+        if profiler is not None:
+            profiler.enable()
+        for name, stage in ALBUM_STAGES:
+            run_stage(name, stage, state)
+        if profiler is not None:
+            profiler.disable()
+    return album_outcome(state, profiler)
+
+
+class StageMetrics:
+    # Per-stage counters for the pipelined runner. `busy` is time spent working on albums;
+    # the depth of the queue feeding a stage shows whether it is the one holding things up.
+    def __init__(self, name, inbox=None):
+        self.name = name
+        self.inbox = inbox
+        self.albums = 0
+        self.busy = 0.0
+        self.max_depth = 0
+
+    def waiting(self):
+        return self.inbox.qsize() if self.inbox is not None else 0
+
+    def observe(self):
+        self.max_depth = max(self.max_depth, self.waiting())
+
+    def as_dict(self, elapsed):
+        return {
+            "stage": self.name,
+            "albums": self.albums,
+            "busy_seconds": round(self.busy, 3),
+            "utilization": round(self.busy / elapsed, 3) if elapsed else 0.0,
+            "albums_per_minute": round(self.albums * 60 / self.busy, 2) if self.busy else 0.0,
+            "queue_depth": self.waiting(),
+            "max_queue_depth": self.max_depth,
+        }
+
+
+class BatchRunner:
+    # Hands albums to a process pool, keeping at most `workers` in flight. Each job gets
+    # its own cancel event (a CancelToken in the worker) so a single album can be stopped,
+    # ffmpeg children and all, without touching the others.
+    # With a manifest, albums whose sources and settings are unchanged are skipped.
+    # With a single worker the stages run as an in-process pipeline instead, so one
+    # album's decode overlaps the previous album's encode and tagging. Pass
+    # pipelined=False when profiling: cProfile cannot follow stages across threads.
+    def __init__(self, workers, on_event, on_result, manifest=None, queue_size=PIPELINE_QUEUE_SIZE,
+                 pipelined=True, journal=None):
+        self.workers = max(1, workers)
+        self.pipelined = pipelined
+        self.journal = journal
+        self.on_event = on_event
+        self.on_result = on_result
+        self.manifest = manifest
+        self.queue_size = queue_size
+        self.cancel_events = {}
+        self.stopped = False
+        self.stage_metrics = []
+        self.started = None
+        self.trace = AlbumTrace()
+        self.traced_albums = 0
+
+    def cancel_job(self, key):
+        event = self.cancel_events.get(key)
+        if event is not None:
+            event.set()
+
+    def cancel_all(self):
+        self.stopped = True
+        for event in list(self.cancel_events.values()):
+            event.set()
+
+    def skip_if_current(self, job):
+        # True when the job needs no conversion: it is up to date, or its folder can no
+        # longer be read (moved or deleted since the scan), which is reported as a failure.
+        if self.manifest is None:
+            return False
+        try:
+            up_to_date, job["signature"], job["rebuild"] = self.manifest.check(job)
+        except OSError as e:
+            print(f"Cannot read {job['album_path']}: {e}", file=sys.stderr)
+            self.finish_job(job, album_result(job["artist"], job["album"]))
+            return True
+        if up_to_date:
+            self.record(job, "done")
+            self.on_result(job, album_result(job["artist"], job["album"], True, skipped=True))
+        return up_to_date
+
+    def record(self, job, status):
+        if self.journal is not None:
+            self.journal.mark(job, status)
+
+    def start_job(self, job, cancel):
+        if self.stopped:
+            cancel.set()
+        self.cancel_events[job["key"]] = cancel
+        self.record(job, "running")
+        self.on_event(job["key"], "started", job)
+
+    def finish_job(self, job, result, cancel=None):
+        if result["success"]:
+            self.record(job, "done")
+        else:
+            self.record(job, "cancelled" if cancel is not None and cancel.is_set() else "failed")
+        if "trace" in result:
+            self.trace.merge(result["trace"])
+            self.traced_albums += 1
+        if self.manifest is not None:
+            if result["success"]:
+                signature = job["signature"]
+                if job.get("artwork", True):
+                    # The cover actually embedded; a remote one may have arrived mid-conversion.
+                    signature = {k: v for k, v in signature.items() if k != "cover"}
+                    if result.get("cover"):
+                        signature["cover"] = result["cover"]
+                self.manifest.record(job, signature)
+                result["rebuilt"] = job["rebuild"]
+            else:
+                self.manifest.forget(job)
+        self.on_result(job, result)
+
+    def drain(self, events):
+        while not events.empty():
+            self.on_event(*events.get())
+
+    def metrics(self):
+        # Live or final per-stage figures; empty unless the pipeline ran.
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return [stage.as_dict(elapsed) for stage in self.stage_metrics]
+
+    def print_metrics(self):
+        for m in self.metrics():
+            print(f"{m['stage']:>6}: {m['albums']} albums, {m['busy_seconds']:.1f}s busy "
+                  f"({m['utilization']:.0%}), {m['albums_per_minute']:.1f} albums/min, "
+                  f"queue max {m['max_queue_depth']}", file=sys.stderr)
+
+    def summary(self):
+        # Stage and track totals over every album converted (not skipped) so far.
+        return dict(self.trace.as_dict(with_tracks=False), albums=self.traced_albums)
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary["albums"]:
+            return
+        stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in summary["stages"].items())
+        counters = ", ".join(f"{name} {n}" for name, n in summary["counters"].items())
+        print(f"Batch of {summary['albums']} album(s): {stages}; {counters}", file=sys.stderr)
+
+    def run(self, next_job):
+        if self.workers == 1 and self.pipelined:
+            self.run_pipelined(next_job)
+        else:
+            self.run_pool(next_job)
+        self.print_summary()
+
+    def run_pool(self, next_job):
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=self.workers) as pool:
+            events = manager.Queue()
+            pending = {}
+            while True:
+                while len(pending) < self.workers and not self.stopped:
+                    job = next_job()
+                    if job is None:
+                        break
+                    if self.skip_if_current(job):
+                        continue
+                    cancel = manager.Event()
+                    self.start_job(job, cancel)
+                    pending[pool.submit(convert_album_job, job, events, cancel)] = job
+                if not pending:
+                    break
+                done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                self.drain(events)
+                for future in done:
+                    job = pending.pop(future)
+                    cancel = self.cancel_events.pop(job["key"], None)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Worker failed on {job['artist']} - {job['album']}: {e}", file=sys.stderr)
+                        result = album_result(job["artist"], job["album"])
+                    self.finish_job(job, result, cancel)
+            self.drain(events)
+
+    def run_pipelined(self, next_job):
+        # One thread per stage, joined by bounded queues; None marks the end of the batch.
+        inboxes = [None] + [queue.Queue(maxsize=self.queue_size) for _ in ALBUM_STAGES[1:]]
+        self.stage_metrics = [StageMetrics(name, inbox) for (name, _), inbox in zip(ALBUM_STAGES, inboxes)]
+        self.started = time.perf_counter()
+        # Held from the start of an album's decode until its encode finishes, so only the
+        # album being encoded and PIPELINE_QUEUE_SIZE decoded ones are in memory; a bounded
+        # queue alone lets the decode stage finish one more album and block holding it.
+        decoded = threading.Semaphore(self.queue_size + 1)
+
+        def feed():
+            while not self.stopped:
+                job = next_job()
+                if job is None:
+                    break
+                if self.skip_if_current(job):
+                    continue
+                key = job["key"]
+                cancel = CancelToken()
+                self.start_job(job, cancel)
+                yield new_album_state(job, lambda kind, *values, key=key: self.on_event(key, kind, *values),
+                                      cancel)
+
+        def work(index):
+            metrics = self.stage_metrics[index]
+            name, stage = ALBUM_STAGES[index]
+            outbox = inboxes[index + 1] if index + 1 < len(inboxes) else None
+            source = feed() if index == 0 else iter(inboxes[index].get, None)
+            try:
+                for state in source:
+                    if name == "decode":
+                        decoded.acquire()
+                    began = time.perf_counter()
+                    try:
+                        run_stage(name, stage, state)
+                    finally:
+                        if name == "encode":
+                            decoded.release()
+                    metrics.busy += time.perf_counter() - began
+                    metrics.albums += 1
+                    if outbox is not None:
+                        outbox.put(state)
+                        self.stage_metrics[index + 1].observe()
+                    else:
+                        cancel = self.cancel_events.pop(state["job"]["key"], None)
+                        self.finish_job(state["job"], album_outcome(state), cancel)
+            finally:
+                # Let the later stages finish even if this one died.
+                if outbox is not None:
+                    outbox.put(None)
+
+        threads = [threading.Thread(target=work, args=(i,), daemon=True) for i in range(len(ALBUM_STAGES))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.print_metrics()
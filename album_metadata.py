@@ -0,0 +1,492 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from album_engine import app_data_dir, find_local_cover
+
+# Album facts and artwork from Wikipedia, MusicBrainz and the Cover Art Archive, plus a
+# persistent cache so a library is only looked up once. Only PIL.Image is used here;
+# turning images into Tk photos is left to the GUI.
+
+USER_AGENT = "AlbumCombiner/1.0 (contact@example.com)"
+ART_SIZE = (400, 400)
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 24 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+# (connect, read) seconds; a lookup may be slow but can never hold anything up for long.
+REQUEST_TIMEOUT = (3.05, 10)
+REQUEST_THREADS = 8
+LOOKUP_THREADS = 3
+# Queued albums whose facts/artwork are looked up ahead of their conversion.
+PREFETCH_AHEAD = 3
+# Requests per second and burst size per host. MusicBrainz allows one request a second
+# per client and answers 503 to anything faster.
+RATE_LIMITS = {
+    "musicbrainz.org": (1.0, 1),
+    "coverartarchive.org": (5.0, 5),
+    "en.wikipedia.org": (10.0, 10),
+}
+DEFAULT_RATE_LIMIT = (5.0, 5)
+# Failed requests (connection errors, timeouts, 429 and 5xx) are retried this many times,
+# waiting RETRY_BACKOFF seconds, doubled each time, or as long as Retry-After asks (capped).
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_RETRY_AFTER = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# "online", "offline" (answer only from responses recorded earlier; nothing touches the
+# network) or "record" (online, saving every response for later offline runs).
+METADATA_MODE = os.environ.get("ALBUM_COMBINER_METADATA", "online")
+
+
+def extract_sentences(text):
+    return [s.strip() + '.' for s in text.replace('\n', ' ').split('.') if len(s.strip()) > 30]
+
+
+def normalize_name(name):
+    return re.sub(r"[\W_]+", " ", name.casefold()).strip()
+
+
+def cache_key(artist, album):
+    return f"{normalize_name(artist)}|{normalize_name(album)}"
+
+
+def make_session(pool_size=REQUEST_THREADS):
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class TokenBucket:
+    # `rate` requests a second on average, up to `burst` at once. hold() empties the
+    # bucket for a while, so a Retry-After from one request slows down every thread.
+    # `sleep` and `clock` are replaceable so the pacing can be tested without waiting.
+    def __init__(self, rate, burst, sleep=time.sleep, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated = clock()
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # Returns the seconds spent waiting for a token.
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            self.sleep(delay)
+            waited += delay
+
+    def hold(self, seconds):
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def url_file_name(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+class ProviderClient:
+    # Every request to Wikipedia, MusicBrainz and the Cover Art Archive goes through here:
+    # one pooled keep-alive session, a token bucket per host, strict timeouts and bounded
+    # retries with exponential backoff that honour Retry-After. With a record_dir, every
+    # final response is also saved there for OfflineClient.
+    def __init__(self, session=None, rate_limits=None, retries=MAX_RETRIES, record_dir=None, sleep=time.sleep,
+                 clock=time.monotonic):
+        self.session = session or make_session()
+        self.rate_limits = RATE_LIMITS if rate_limits is None else rate_limits
+        self.retries = retries
+        self.record_dir = record_dir
+        self.sleep = sleep
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "wait_seconds": 0.0}
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                rate, burst = self.rate_limits.get(host, DEFAULT_RATE_LIMIT)
+                self.buckets[host] = TokenBucket(rate, burst, self.sleep, self.clock)
+            return self.buckets[host]
+
+    def count(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+    def get(self, url):
+        bucket = self.bucket(urlsplit(url).hostname)
+        for attempt in range(self.retries + 1):
+            self.count(requests=1, wait_seconds=bucket.acquire())
+            last = attempt == self.retries
+            delay = RETRY_BACKOFF * 2 ** attempt
+            try:
+                response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last:
+                    self.save(url, response)
+                    return response
+                wait = retry_after(response)
+                if wait is not None:
+                    # The server asked the whole host to back off; the next acquire() waits.
+                    bucket.hold(wait)
+                    delay = 0
+            self.count(retries=1)
+            if delay:
+                self.sleep(delay)
+
+    def save(self, url, response):
+        if self.record_dir is None or response.status_code != 200:
+            return
+        os.makedirs(self.record_dir, exist_ok=True)
+        path = os.path.join(self.record_dir, url_file_name(url))
+        with open(f"{path}.part", "wb") as f:
+            f.write(response.content)
+        os.replace(f"{path}.part", path)
+
+    def close(self):
+        self.session.close()
+
+
+class OfflineClient:
+    # The local stand-in for ProviderClient: answers from responses a "record" run saved,
+    # and 404 for everything else, without opening a socket. Lookups can be tested and
+    # libraries browsed with no network at all.
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = {"requests": 0, "retries": 0, "wait_seconds": 0.0}
+
+    def get(self, url):
+        self.stats["requests"] += 1
+        response = requests.Response()
+        response.url = url
+        try:
+            with open(os.path.join(self.directory, url_file_name(url)), "rb") as f:
+                response._content = f.read()
+            response.status_code = 200
+        except FileNotFoundError:
+            response._content = b""
+            response.status_code = 404
+            response.reason = "Not recorded"
+        return response
+
+    def close(self):
+        pass
+
+
+def make_client(mode=None, directory=None):
+    mode = mode or METADATA_MODE
+    directory = directory or os.path.join(app_data_dir(), "metadata", "offline")
+    if mode == "offline":
+        return OfflineClient(directory)
+    return ProviderClient(record_dir=directory if mode == "record" else None)
+
+
+def wikipedia_summary(client, title):
+    url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{title.replace(' ', '_')}"
+    response = client.get(url)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def wikipedia_search(client, term):
+    search_url = f"https://en.wikipedia.org/w/api.php?action=query&list=search&srsearch={requests.utils.quote(term)}&format=json"
+    response = client.get(search_url)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    results = response.json().get("query", {}).get("search")
+    return results[0]["title"] if results else None
+
+
+def decode_art(source):
+    # Decoded once, on a lookup thread. draft() lets the JPEG decoder scale down by up to
+    # 8x while decoding; bilinear with a reducing gap finishes the job cheaply.
+    image = Image.open(source)
+    image.draft("RGB", ART_SIZE)
+    return image.convert("RGB").resize(ART_SIZE, Image.BILINEAR, reducing_gap=2.0)
+
+
+def fetch_image(client, url):
+    response = client.get(url)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return decode_art(BytesIO(response.content))
+
+
+def musicbrainz_cover(client, artist, album):
+    query = f'releasegroup:"{album}" AND artist:"{artist}"'
+    mb_url = f"https://musicbrainz.org/ws/2/release-group/?query={requests.utils.quote(query)}&fmt=json"
+    mb_resp = client.get(mb_url)
+    if mb_resp.status_code == 404:
+        return None
+    mb_resp.raise_for_status()
+    groups = mb_resp.json().get("release-groups")
+    if not groups:
+        return None
+    caa_url = f"https://coverartarchive.org/release-group/{groups[0]['id']}/front-500"
+    return fetch_image(client, caa_url)
+
+
+def fetch_album_metadata(artist, album, client=None, request_pool=None):
+    # "complete" is False when a request failed outright (as opposed to finding nothing),
+    # so a flaky connection is not remembered as a miss.
+    if client is None:
+        client = make_client()
+    if request_pool is None:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            return fetch_album_metadata(artist, album, client, pool)
+    metadata = {"summaries": {}, "sentences": [], "art": None, "complete": True}
+
+    def attempt(label, lookup, *args):
+        try:
+            return lookup(client, *args)
+        except Exception as e:
+            print(f"{label} lookup failed for {artist} - {album}: {e}", file=sys.stderr)
+            metadata["complete"] = False
+            return None
+
+    # The album, "artist album" and artist pages are independent, so ask for all three at once.
+    terms = (album, f"{artist} {album}", artist)
+    pending = [request_pool.submit(attempt, "Wikipedia", wikipedia_summary, term) for term in terms]
+    summaries = list(zip(terms, [future.result() for future in pending]))
+    album_data = summaries[0][1]
+    if album_data is None:
+        title = attempt("Wikipedia search", wikipedia_search, f"{artist} {album}")
+        if title:
+            album_data = attempt("Wikipedia", wikipedia_summary, title)
+            summaries[0] = (album, album_data)
+    for term, data in summaries:
+        if data:
+            metadata["summaries"][term] = data
+            if 'extract' in data:
+                metadata["sentences"] += extract_sentences(data['extract'])
+
+    if album_data and 'thumbnail' in album_data:
+        metadata["art"] = attempt("Artwork", fetch_image, album_data['thumbnail']['source'])
+    if metadata["art"] is None:
+        metadata["art"] = attempt("MusicBrainz/CoverArtArchive", musicbrainz_cover, artist, album)
+    return metadata
+
+
+class MetadataCache:
+    # index.json holds the summaries and sentences per normalized artist/album; artwork is
+    # stored already resized next to it. Entries expire after a TTL (shorter for misses)
+    # and the least recently used ones are evicted once the cache outgrows max_bytes. Hits
+    # only touch the in-memory index; it is written on put() and close().
+    def __init__(self, directory=None, ttl=CACHE_TTL_SECONDS, negative_ttl=NEGATIVE_TTL_SECONDS,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory or os.path.join(app_data_dir(), "metadata")
+        self.art_dir = os.path.join(self.directory, "art")
+        os.makedirs(self.art_dir, exist_ok=True)
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.dirty = False
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def art_path(self, key):
+        return os.path.join(self.art_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg")
+
+    def get(self, artist, album):
+        key = cache_key(artist, album)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            ttl = self.negative_ttl if entry["miss"] else self.ttl
+            if time.time() - entry["fetched"] > ttl:
+                self.remove(key)
+                return None
+            art = None
+            if entry["art"]:
+                try:
+                    art = Image.open(self.art_path(key))
+                    art.load()
+                except OSError:
+                    self.remove(key)
+                    return None
+            entry["used"] = time.time()
+            self.dirty = True
+            return {"summaries": entry["summaries"], "sentences": entry["sentences"], "art": art,
+                    "complete": True}
+
+    def put(self, artist, album, metadata):
+        key = cache_key(artist, album)
+        art = metadata["art"]
+        now = time.time()
+        with self.lock:
+            size = 0
+            if art is not None:
+                # Conversions read this file as the fallback cover, so it is never seen half-written.
+                path = self.art_path(key)
+                art.save(f"{path}.part", "JPEG", quality=90)
+                os.replace(f"{path}.part", path)
+                size = os.path.getsize(path)
+            entry = {
+                "summaries": metadata["summaries"],
+                "sentences": metadata["sentences"],
+                "art": art is not None,
+                "miss": art is None and not metadata["sentences"],
+                "fetched": now,
+                "used": now,
+            }
+            entry["size"] = size + len(json.dumps(entry))
+            self.index[key] = entry
+            self.evict()
+            self.save()
+
+    def close(self):
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+    def remove(self, key):
+        self.dirty = True
+        entry = self.index.pop(key, None)
+        if entry and entry["art"]:
+            try:
+                os.remove(self.art_path(key))
+            except OSError:
+                pass
+
+    def evict(self):
+        total = sum(e["size"] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]["size"]
+            self.remove(key)
+
+    def save(self):
+        partial = f"{self.index_path}.part"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(partial, self.index_path)
+        self.dirty = False
+
+
+class MetadataService:
+    # Runs lookups on background threads through one provider client, answering from the
+    # cache when it can. Concurrent requests for the same album share a single lookup. `stats`
+    # counts lookups, cache hits and the time spent fetching from the network. A cover in
+    # the album folder replaces the remote artwork, as it does in the converted file.
+    def __init__(self, cache=None, workers=LOOKUP_THREADS, client=None):
+        self.cache = cache or MetadataCache()
+        self.client = client or make_client()
+        # Offline answers are not the real thing; keep them out of the cache.
+        self.cache_results = not isinstance(self.client, OfflineClient)
+        self.request_pool = ThreadPoolExecutor(max_workers=REQUEST_THREADS)
+        self.lookup_pool = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "cache_hits": 0, "fetches": 0, "fetch_seconds": 0.0}
+
+    def load(self, artist, album, album_path=None):
+        metadata = self.cache.get(artist, album)
+        if metadata is not None:
+            self.record(lookups=1, cache_hits=1)
+        else:
+            start = time.perf_counter()
+            metadata = fetch_album_metadata(artist, album, self.client, self.request_pool)
+            self.record(lookups=1, fetches=1, fetch_seconds=time.perf_counter() - start)
+            if metadata["complete"] and self.cache_results:
+                self.cache.put(artist, album, metadata)
+        local_cover = find_local_cover(album_path) if album_path else None
+        if local_cover:
+            try:
+                metadata = dict(metadata, art=decode_art(local_cover))
+            except OSError as e:
+                print(f"Could not read {local_cover}: {e}", file=sys.stderr)
+        return metadata
+
+    def art_file(self, artist, album):
+        # Where the remote cover is cached, whether or not it has been fetched yet.
+        return self.cache.art_path(cache_key(artist, album))
+
+    def record(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+    def stats_since(self, earlier):
+        with self.lock:
+            return {name: value - earlier.get(name, 0) for name, value in self.stats.items()}
+
+    def lookup(self, artist, album, album_path=None):
+        key = cache_key(artist, album)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+            future = self.lookup_pool.submit(self.load, artist, album, album_path)
+            self.in_flight[key] = future
+        future.add_done_callback(lambda f: self.finished(key, f))
+        return future
+
+    def finished(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+    def prefetch(self, albums):
+        # (artist, album, album_path) triples.
+        for artist, album, album_path in albums:
+            self.lookup(artist, album, album_path)
+
+    def shutdown(self):
+        self.lookup_pool.shutdown(wait=False, cancel_futures=True)
+        self.request_pool.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
+        self.cache.close()
@@ -0,0 +1,16 @@
+import pytest
+
+from album_engine import AlbumManifest, BatchRunner, make_job
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_unreadable_album_folders_fail_without_stopping_the_batch(tmp_path, workers):
+    # Folders that vanished after the scan (or after a journal was saved) are reported as
+    # failed one by one instead of killing the batch.
+    jobs = iter([make_job("Artist", f"Album {i}", str(tmp_path / f"gone {i}"), str(tmp_path / "out"), "192k")
+                 for i in range(3)])
+    results = []
+    runner = BatchRunner(workers, lambda *event: None, lambda job, result: results.append(result),
+                         AlbumManifest(str(tmp_path)))
+    runner.run(lambda: next(jobs, None))
+    assert [(r["album"], r["success"]) for r in results] == [(f"Album {i}", False) for i in range(3)]
@@ -0,0 +1,57 @@
+import album_engine
+from album_engine import AlbumFingerprint, fingerprint_album, group_duplicates, same_recording
+
+
+def fingerprint(name, durations, lossless=False, bit_rate=320000, audio_hash=None):
+    return AlbumFingerprint(("Artist", name), f"/music/{name}", durations, lossless, 44100, bit_rate, audio_hash)
+
+
+def keys(groups):
+    return [[fp.key[1] for fp in group] for group in groups]
+
+
+def test_copies_grouped_best_first():
+    mp3 = fingerprint("mp3", [200.0, 180.5, 240.0], bit_rate=192000)
+    flac = fingerprint("flac", [200.4, 181.0, 239.2], lossless=True, bit_rate=900000)
+    other = fingerprint("other", [100.0, 180.0, 240.0])
+    assert keys(group_duplicates([mp3, other, flac])) == [["flac", "mp3"]]
+
+
+def test_lengths_do_not_chain_through_a_middle_copy():
+    # b is within the tolerance of both a and c, but a and c are 3 s apart.
+    a = fingerprint("a", [200.0, 180.0, 240.0], lossless=True)
+    b = fingerprint("b", [201.5, 181.5, 241.5])
+    c = fingerprint("c", [203.0, 183.0, 243.0], bit_rate=128000)
+    groups = group_duplicates([c, b, a])
+    assert keys(groups) == [["a", "b"]]
+    assert not same_recording(a, c)
+
+
+def test_short_albums_need_the_audio_hash():
+    single = fingerprint("single", [215.0])
+    other_single = fingerprint("other single", [216.2])
+    assert group_duplicates([single, other_single]) == []
+
+    hashed = fingerprint("single", [215.0], audio_hash="0110" * 12)
+    same = fingerprint("copy", [215.3], audio_hash="0110" * 12)
+    different = fingerprint("different", [216.0], audio_hash="1001" * 12)
+    assert keys(group_duplicates([hashed, same, different])) == [["single", "copy"]]
+
+
+def test_track_count_must_match():
+    a = fingerprint("a", [200.0, 180.0, 240.0])
+    b = fingerprint("b", [200.0, 180.0, 240.0, 30.0])
+    assert group_duplicates([a, b]) == []
+
+
+def test_copies_hash_from_the_same_offset(tmp_path, monkeypatch):
+    # First tracks 1.5 s apart (within the tolerance) must hash the same stretch of audio.
+    lengths = {"a": 60.0, "b": 61.5}
+    starts = []
+    monkeypatch.setattr(album_engine, "quick_track_info", lambda path: (lengths[path[-1]], False, 44100, 320000))
+    monkeypatch.setattr(album_engine, "quick_audio_hash", lambda path, start: starts.append(start) or "01")
+    for name in lengths:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / f"01 {name}").write_bytes(b"")
+        fingerprint_album(("Artist", name), str(tmp_path / name), quick_hash=True)
+    assert len(starts) == 2 and starts[0] == starts[1]
@@ -0,0 +1,76 @@
+from album_engine import MP3_DECODER_DELAY, TrackInfo, gapless_bounds, parse_itunsmpb, read_lame_gapless
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo: the Xing/Info tag follows 32 bytes of side info.
+FRAME_HEADER = b"\xff\xfb\x90\x00"
+
+
+def lame_frame(frames, delay, padding):
+    info = b"Info" + (0x0F).to_bytes(4, "big") + frames.to_bytes(4, "big")
+    info += (417 * frames).to_bytes(4, "big") + bytes(100) + (0).to_bytes(4, "big")
+    lame = b"LAME3.100" + bytes(12) + bytes([delay >> 4, (delay & 0x0F) << 4 | padding >> 8, padding & 0xFF])
+    frame = FRAME_HEADER + bytes(32) + info + lame
+    return frame + bytes(417 - len(frame))
+
+
+def id3_tag(size):
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + syncsafe + bytes(size)
+
+
+def mp3_file(tmp_path, data):
+    path = tmp_path / "track.mp3"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_lame_header(tmp_path):
+    path = mp3_file(tmp_path, lame_frame(1000, 576, 1200))
+    assert read_lame_gapless(path) == (576 + MP3_DECODER_DELAY, 1200 - MP3_DECODER_DELAY, 1000 * 1152 - 576 - 1200)
+
+
+def test_lame_header_after_id3_tag(tmp_path):
+    path = mp3_file(tmp_path, id3_tag(300) + lame_frame(20, 576, 600))
+    assert read_lame_gapless(path) == (576 + MP3_DECODER_DELAY, 600 - MP3_DECODER_DELAY, 20 * 1152 - 576 - 600)
+
+
+def test_no_lame_header(tmp_path):
+    frame = bytearray(lame_frame(1000, 576, 1200))
+    frame[36:40] = bytes(4)  # no Xing/Info tag
+    assert read_lame_gapless(mp3_file(tmp_path, bytes(frame))) is None
+    assert read_lame_gapless(mp3_file(tmp_path, lame_frame(1000, 0, 0))) is None
+    assert read_lame_gapless(mp3_file(tmp_path, b"RIFF" + bytes(60))) is None
+
+
+def test_itunsmpb():
+    value = " 00000000 00000840 000001CA 00000000001CF4A6 00000000 00000000"
+    assert parse_itunsmpb(value) == (0x840, 0x1CA, 0x1CF4A6)
+    assert parse_itunsmpb(" 00000000 00000840") is None
+
+
+def track(gapless, sample_rate=44100):
+    return TrackInfo("track.mp3", 0, 0, "mp3", sample_rate, 2, 0, gapless)
+
+
+def test_bounds_trim_priming_and_padding():
+    priming, padding, valid = 1105, 671, 100000
+    frames = priming + valid + padding
+    assert gapless_bounds(track((priming, padding, valid)), frames, 44100) == (priming, priming + valid)
+
+
+def test_bounds_trim_padding_when_priming_already_dropped():
+    priming, padding, valid = 1105, 671, 100000
+    assert gapless_bounds(track((priming, padding, valid)), valid + padding, 44100) == (0, valid)
+
+
+def test_bounds_keep_everything_when_nothing_to_trim_or_header_is_wrong():
+    gapless = (1105, 671, 100000)
+    assert gapless_bounds(track(gapless), 100000, 44100) == (0, 100000)
+    assert gapless_bounds(track(gapless), 200000, 44100) == (0, 200000)
+    assert gapless_bounds(track(None), 5000, 44100) == (0, 5000)
+
+
+def test_bounds_scale_to_the_output_rate():
+    # A 44.1 kHz track decoded at 88.2 kHz: every count in the header doubles.
+    priming, padding, valid = 1105, 671, 100000
+    frames = 2 * (priming + valid + padding)
+    assert gapless_bounds(track((priming, padding, valid)), frames, 88200) == (2 * priming, 2 * (priming + valid))
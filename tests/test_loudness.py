@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from album_engine import LOUDNESS_TARGET_LUFS, LoudnessMeter  # noqa: E402
+
+
+def tone(dbfs, seconds=10, frequency=997, frame_rate=48000, channels=1):
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    wave = np.sin(2 * np.pi * frequency * t) * 10 ** (dbfs / 20) * 32767
+    return np.repeat(wave.astype(np.int16)[:, None], channels, axis=1).tobytes()
+
+
+def measure(data, frame_rate=48000, channels=1, mode="tags"):
+    meter = LoudnessMeter(frame_rate, channels, mode)
+    out = meter.process(data)
+    return meter, out
+
+
+def test_reference_tone_mono():
+    # BS.1770: a 997 Hz sine peaking at -20 dBFS in one channel reads -23 LUFS.
+    meter, _ = measure(tone(-20))
+    assert meter.loudness() == pytest.approx(-23.0, abs=0.1)
+
+
+def test_reference_tone_stereo_and_44k():
+    meter, _ = measure(tone(-23, frame_rate=44100, channels=2), frame_rate=44100, channels=2)
+    assert meter.loudness() == pytest.approx(-23.0, abs=0.1)
+
+
+def test_silence_is_gated_out():
+    meter, _ = measure(bytes(48000 * 2 * 5))
+    assert meter.loudness() is None
+    assert meter.tags() == {}
+
+
+def test_quiet_passages_do_not_pull_the_album_down():
+    # Silence between tracks falls under the absolute gate.
+    meter = LoudnessMeter(48000, 1, "tags")
+    meter.process(tone(-20, seconds=5))
+    meter.process(bytes(48000 * 2 * 20))
+    assert meter.loudness() == pytest.approx(-23.0, abs=0.1)
+
+
+def test_track_mode_levels_to_the_target():
+    meter, out = measure(tone(-30), mode="track")
+    check, _ = measure(out)
+    assert check.loudness() == pytest.approx(LOUDNESS_TARGET_LUFS, abs=0.1)
+    assert meter.tags()["replaygain_track_gain"] == "+0.00 dB"
+
+
+def test_gain_never_pushes_peaks_past_full_scale():
+    # 20 dB would take a half-scale peak to 5x full scale; the boost stops at 2x.
+    assert LoudnessMeter.gain_factor(20.0, 0.5) == pytest.approx(2.0)
+    assert LoudnessMeter.gain_factor(-6.0, 0.5) == pytest.approx(10 ** (-6 / 20))
+
+
+def test_album_gain_and_tags():
+    meter = LoudnessMeter(48000, 1, "album")
+    meter.process(tone(-20))
+    factor = meter.album_factor()
+    assert 20 * np.log10(factor) == pytest.approx(LOUDNESS_TARGET_LUFS + 23.0, abs=0.1)
+    tags = meter.tags()
+    assert tags["replaygain_album_gain"] == tags["replaygain_track_gain"] == "+0.00 dB"
+    assert float(tags["replaygain_album_peak"]) == pytest.approx(0.1 * factor, rel=1e-3)
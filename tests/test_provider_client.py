@@ -0,0 +1,109 @@
+import pytest
+import requests
+
+from album_metadata import OfflineClient, ProviderClient, TokenBucket, fetch_album_metadata, retry_after
+
+
+class FakeClock:
+    # Time only moves when someone sleeps.
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, content=b"{}"):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+
+class FakeSession:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.urls = []
+
+    def get(self, url, timeout):
+        self.urls.append(url)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def close(self):
+        pass
+
+
+def client(replies, clock, **kwargs):
+    return ProviderClient(FakeSession(replies), sleep=clock.sleep, clock=clock, **kwargs)
+
+
+def test_bucket_paces_requests_after_the_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(2.0, 2, clock.sleep, clock)
+    waits = [bucket.acquire() for _ in range(5)]
+    assert waits[:2] == [0.0, 0.0]
+    assert clock.now == pytest.approx(1.5)
+
+
+def test_hold_backs_off_the_whole_host():
+    clock = FakeClock()
+    bucket = TokenBucket(1.0, 1, clock.sleep, clock)
+    bucket.hold(10)
+    bucket.acquire()
+    assert clock.now == pytest.approx(11.0)
+
+
+def test_retries_with_backoff_then_succeeds():
+    clock = FakeClock()
+    replies = [requests.ConnectionError(), FakeResponse(503), FakeResponse(200)]
+    c = client(replies, clock, rate_limits={"example.org": (1000.0, 10)})
+    assert c.get("https://example.org/a").status_code == 200
+    assert clock.sleeps == [0.5, 1.0]
+    assert c.stats["requests"] == 3 and c.stats["retries"] == 2
+
+
+def test_retry_after_is_honoured_through_the_bucket():
+    clock = FakeClock()
+    replies = [FakeResponse(429, {"Retry-After": "7"}), FakeResponse(200)]
+    c = client(replies, clock, rate_limits={"example.org": (1000.0, 10)})
+    assert c.get("https://example.org/a").status_code == 200
+    assert clock.now == pytest.approx(7.0, abs=0.01)
+
+
+def test_gives_up_after_the_last_retry():
+    clock = FakeClock()
+    c = client([FakeResponse(500)] * 4, clock, retries=3)
+    assert c.get("https://example.org/a").status_code == 500
+    with pytest.raises(requests.Timeout):
+        client([requests.Timeout()] * 2, clock, retries=1).get("https://example.org/a")
+
+
+def test_retry_after_dates_are_capped():
+    assert retry_after(FakeResponse(429, {"Retry-After": "Wed, 21 Oct 2099 07:28:00 GMT"})) == 30
+    assert retry_after(FakeResponse(429, {"Retry-After": "soon"})) is None
+    assert retry_after(FakeResponse(429)) is None
+
+
+def test_recorded_responses_replay_offline(tmp_path):
+    clock = FakeClock()
+    recorder = client([FakeResponse(200, content=b'{"title": "x"}'), FakeResponse(404)], clock,
+                      record_dir=str(tmp_path))
+    recorder.get("https://example.org/found")
+    recorder.get("https://example.org/missing")
+    offline = OfflineClient(str(tmp_path))
+    assert offline.get("https://example.org/found").json() == {"title": "x"}
+    assert offline.get("https://example.org/missing").status_code == 404
+
+
+def test_offline_lookup_of_an_unrecorded_album_is_a_clean_miss(tmp_path, capsys):
+    metadata = fetch_album_metadata("Artist", "Album", OfflineClient(str(tmp_path)))
+    assert metadata == {"summaries": {}, "sentences": [], "art": None, "complete": True}
+    assert "lookup failed" not in capsys.readouterr().err